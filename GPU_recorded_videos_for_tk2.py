@@ -6,6 +6,14 @@ import time
 import os
 from dotenv import load_dotenv
 from tqdm import tqdm  
+from adaptive_interval import controller_from_env
+from detection_cache import DetectionCache
+from display_utils import display_from_env
+from frame_sources import FrameSampler, prefetch_from_env
+from model_registry import load_model
+from motion_gate import motion_gate_from_env
+from tuning_profile import apply_profile
+from video_writers import async_writer_from_env, writer_from_env
 
 
 print(torch.__version__)
@@ -14,8 +22,11 @@ print(torch.cuda.is_available())
 print(torch.cuda.get_device_name(0) if torch.cuda.is_available() else "CUDA not available")
 
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 # Load environment configurations
 load_dotenv()
+apply_profile()
 drone = os.getenv('DRONE_NAME', 'your_drone')
 output_dir = os.getenv('OUTPUT_DIR', 'output_videos')
 video_path = os.getenv('VIDEO_PATH', 'path_to_your_video_file.mp4')  # Path to your recorded video
@@ -25,8 +36,10 @@ if torch.cuda.is_available():
     logging.info(f"CUDA is available. Using GPU: {torch.cuda.get_device_name(0)}")
     device = torch.device("cuda:0")
 else:
-    logging.error("CUDA is not available. Exiting...")
-    exit()
+    # Threads and input size come from the autotune profile (python autotune.py); frames go one at a time
+    logging.warning(f"CUDA is not available. Running on the CPU with {torch.get_num_threads()} threads.")
+    device = torch.device("cpu")
+inference_size = int(os.getenv('INFERENCE_SIZE', '640'))
 
 
 
@@ -37,12 +50,12 @@ model_name = 'yolov5x'
 if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info(f"Starting object detection with {model_name} on recorded video!")
 
 try:
-    torch.hub._validate_not_a_forked_repo=lambda a,b,c: True  # Bypass local cache issue
-    model = torch.hub.load('ultralytics/yolov5', 'yolov5x', pretrained=True).to(device)
+    # Pre-built copy from the local model registry: no hub cache validation, works offline.
+    # Always torch on the GPU; on the CPU INFERENCE_BACKEND applies, as in the other scripts.
+    model = load_model(model_name, backend="torch" if device.type == "cuda" else None).to(device)
 
     
     model.conf = 0.45
@@ -52,48 +65,22 @@ except Exception as e:
     exit()
 
 
-def resize_image(image, stride=32):
-    new_width = (image.shape[1] // stride + 1) * stride if image.shape[1] % stride != 0 else image.shape[1]
-    new_height = (image.shape[0] // stride + 1) * stride if image.shape[0] % stride != 0 else image.shape[0]
-    resized_image = cv2.resize(image, (new_width, new_height))
-    return resized_image
-
-
-results = None
+# Last keyframe's boxes, drawn onto every following frame until the next keyframe
+detection_cache = DetectionCache(model.names)
+last_inference_time = None  # Seconds spent in the model on the latest keyframe, None otherwise
 
 def detect_objects(frame, update_detection):
-    global results
+    global last_inference_time
+    last_inference_time = None
     if update_detection:
-        # Resize frame to match model's expected dimensions
-        frame = resize_image(frame)
-
-        # Convert frame to tensor and move to GPU
+        start = time.perf_counter()
+        # The model letterboxes and normalises the frame itself and moves it to its device.
+        # A raw tensor would skip that and return undecoded predictions without boxes.
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        frame_tensor = torch.from_numpy(frame_rgb).to(device).unsqueeze(0)  # Add batch dimension and move to GPU
-        
-        frame_tensor = frame_tensor.permute(0, 3, 1, 2)  # Change dimension order to NCHW
-        frame_tensor = frame_tensor.float() / 255.0  # Normalize to [0, 1]
-        print(frame_tensor.shape)
-        # Perform inference
-        results = model(frame_tensor)
-
-        # Check if 'results' has the 'render' method
-        if hasattr(results, 'render'):
-            # Convert results to CPU for OpenCV compatibility and render detections
-            frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-        else:
-            print("The 'results' object does not have a 'render' method.")
-            # Handle the case where results does not have the 'render' method
-            # This might involve logging an error or taking some other action
-                
-            # Convert results to CPU for OpenCV compatibility
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    elif results:
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    else:
-        frame_bgr = frame
-    return frame_bgr
+        results = model(frame_rgb, size=controller.size if controller else inference_size)
+        detection_cache.update_from_results(results)
+        last_inference_time = time.perf_counter() - start
+    return detection_cache.draw(frame)
 
 
 # Open the recorded video
@@ -103,7 +90,7 @@ if not cap.isOpened():
     exit()
 
 total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-source_fps = cap.get(cv2.CAP_PROP_FPS)
+source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0  # Some containers report 0
 frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
@@ -114,41 +101,74 @@ proc_file_path = os.path.join(output_dir, processed_output_filename)
 unproc_file_path = os.path.join(output_dir, unprocessed_output_filename)
 
 fourcc = cv2.VideoWriter_fourcc(*'XVID')
-proc_out = cv2.VideoWriter(proc_file_path, fourcc, source_fps, (frame_width, frame_height))
+proc_out = writer_from_env(proc_file_path, fourcc, source_fps, (frame_width, frame_height))
+# ASYNC_IO=1 decodes ahead and encodes in background threads, so inference never waits on I/O
+proc_out = async_writer_from_env(proc_out)
+prefetch = prefetch_from_env(FrameSampler(cap, source_fps).read)
 unproc_out = cv2.VideoWriter(unproc_file_path, fourcc, source_fps, (frame_width, frame_height))
 
-detection_interval = 1
+detection_interval = int(os.getenv('DETECTION_INTERVAL', '1'))
+# Tunes detection_interval (and optionally the inference size) at runtime when ADAPTIVE_INTERVAL=1
+controller = controller_from_env(source_fps)
+
+# Reuses the previous detections on static frames when MOTION_GATE=1
+motion_gate = motion_gate_from_env()
+frame_index = 0
+# No GUI calls when HEADLESS=1; PREVIEW_PORT serves an MJPEG preview instead
+display = display_from_env()
 
 # Create a tqdm progress bar
 pbar = tqdm(total=total_frames, desc="Processing Frames")
 
 try:
     while True:
-        ret, frame = cap.read()
+        if prefetch:
+            _, frame = prefetch.read()
+            ret = frame is not None
+        else:
+            ret, frame = cap.read()
         if not ret:
             logging.info("End of video file reached.")
             break
 
-        update_detection = (total_frames % detection_interval) == 0
+        frame_start = time.perf_counter()
+        if controller:
+            update_detection = controller.should_detect()
+        else:
+            update_detection = (frame_index % detection_interval) == 0
+        if update_detection and motion_gate:
+            update_detection = motion_gate.should_infer(frame)
         processed_frame = detect_objects(frame, update_detection)
 
         # unproc_out.write(frame)  # Save original frame to unprocessed video
         proc_out.write(processed_frame)  # Save processed frame to processed video
 
+        if controller:
+            controller.record_frame(time.perf_counter() - frame_start, last_inference_time)
+        frame_index += 1
+
         pbar.update(1)  # Update the progress bar by one step
+        if prefetch:
+            # Full decode queue: inference is the bottleneck; full write queue: encoding is
+            pbar.set_postfix(decode_queue=prefetch.depth(), write_queue=proc_out.depth())
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        display.publish(processed_frame)
+        if display.poll_key() == ord('q'):
             break
 except KeyboardInterrupt:
     logging.info("Interrupted by user.")
 finally:
+    if prefetch:
+        prefetch.stop()
     cap.release()
     proc_out.release()
     # unproc_out.release()
-    cv2.destroyAllWindows()
+    display.close()
     pbar.close()  # Close the progress bar
 
     # Log the full path of the output files
     logging.info(f"Video processing concluded.")
+    if motion_gate:
+        logging.info(f"Motion gate: {motion_gate.format_report()}")
     logging.info(f"Processed video saved to: {os.path.abspath(proc_file_path)}")
     logging.info(f"Unprocessed video saved to: {os.path.abspath(unproc_file_path)}")
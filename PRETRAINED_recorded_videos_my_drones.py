@@ -1,14 +1,33 @@
 import logging
 import os
+import time
 from datetime import datetime
 
 import cv2
-import torch
 from dotenv import find_dotenv, load_dotenv
 from tqdm import tqdm  # Import tqdm for the progress bar
 
+from adaptive_interval import controller_from_env
+from box_propagation import propagator_from_env
+from detection_cache import DetectionCache, detections_from_results
+from detection_log import DetectionLog, detection_log_path, detections_only_from_env
+from display_utils import display_from_env
+from frame_sources import FrameSampler, prefetch_from_env
+from model_cascade import cascade_from_env
+from model_registry import load_model
+from motion_gate import motion_gate_from_env
+from tiled_inference import tiled_detector_from_env
+from tuning_profile import apply_profile
+from video_writers import async_writer_from_env, writer_from_env
+
+# Initialize logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
 # Load environment configurations
 load_dotenv()
+apply_profile()
 dotenv_path = find_dotenv()
 print(f"Attempting to load .env file from: {dotenv_path}")
 drone = os.getenv("DRONE_NAME", "your_drone")
@@ -32,34 +51,74 @@ print(
 if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
-# Initialize logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 logging.info(f"Starting object detection with {model_name} on recorded video!")
 
 try:
-    model = torch.hub.load(model_repository, model_name, pretrained=True)
+    model = load_model(model_name)  # Pre-built copy from the local model registry
     model.conf = 0.45
     logging.info(f"{model_name} model loaded successfully.")
 except Exception as e:
     logging.error(f"Failed to load model: {e}")
     exit()
 
-results = None
-
-
-def detect_objects(frame, update_detection):
-    global results
-    if update_detection:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = model(frame_rgb)
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    elif results:
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    else:
-        frame_bgr = frame
-    return frame_bgr
+# Last keyframe's boxes, drawn onto every following frame until the next keyframe
+detection_cache = DetectionCache(model.names)
+# Overlapping tiles at native resolution when TILED_INFERENCE=1, for small objects in 4K footage
+tiled_detector = tiled_detector_from_env(model)
+# Light model on every frame, this model only on uncertain or new objects when CASCADE=1
+cascade = cascade_from_env(model)
+# Moves the last keyframe's boxes with optical flow on the frames in between when BOX_PROPAGATION=1
+propagator = propagator_from_env()
+last_inference_time = None  # Seconds spent in the model on the latest keyframe, None otherwise
+
+
+def detect_objects(frames, update_flags, indices):
+    """
+    Run the model over the keyframes of a batch and draw every frame in order.
+
+    Plain inference sends all keyframes of the batch through one forward pass;
+    tiled and cascade inference still go frame by frame.
+
+    Parameters:
+    - frames: Consecutive BGR frames.
+    - update_flags: Whether each frame is a keyframe.
+    - indices: Source frame index of each frame, for the detection log.
+
+    Returns:
+    - The annotated frames, in the same order; empty in detections-only mode.
+    """
+    global last_inference_time
+    last_inference_time = None
+    keyframes_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame, update in zip(frames, update_flags) if update]
+    detections = []
+    if keyframes_rgb:
+        start = time.perf_counter()
+        size = controller.size if controller else inference_size
+        if tiled_detector:
+            detections = [tiled_detector(frame_rgb) for frame_rgb in keyframes_rgb]
+        elif cascade:
+            detections = [cascade(frame_rgb, size) for frame_rgb in keyframes_rgb]
+        else:
+            results = model(keyframes_rgb, size=size)
+            detections = [detections_from_results(results, i) for i in range(len(keyframes_rgb))]
+        # Per keyframe, so the adaptive controller sees the cost of a single detection
+        last_inference_time = (time.perf_counter() - start) / len(keyframes_rgb)
+
+    detections = iter(detections)
+    processed_frames = []
+    for index, frame, update in zip(indices, frames, update_flags):
+        if update:
+            detection_cache.update(next(detections))
+            if detection_log:
+                detection_log.append(index, index / source_fps, detection_cache.detections)
+            if propagator:
+                propagator.reset(frame, detection_cache.detections)
+        elif propagator:
+            detection_cache.update(propagator.propagate(frame))
+        if not detections_only:
+            # The raw frame is not written anywhere else, so draw on it directly
+            processed_frames.append(detection_cache.draw(frame, copy=False))
+    return processed_frames
 
 
 # Open the recorded video
@@ -69,9 +128,15 @@ if not cap.isOpened():
     exit()
 
 total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-source_fps = cap.get(cv2.CAP_PROP_FPS)
+source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0  # Some containers report 0
 frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+# SAMPLE_FPS analyses only that many frames per second; the rest are skipped without being converted
+sampler = FrameSampler(
+    cap, source_fps, float(os.getenv("SAMPLE_FPS", "0")), int(os.getenv("SAMPLE_SEEK_GAP", "0"))
+)
+if sampler.step > 1:
+    logging.info(f"Sampling every {sampler.step}th frame ({sampler.output_fps:.2f} FPS of {source_fps:.2f}).")
 
 current_time = datetime.now().strftime("%d_%H%M")
 processed_output_filename = f"{drone}_{model_name}_PROC_{current_time}.mp4"
@@ -79,44 +144,94 @@ unprocessed_output_filename = f"{drone}_{model_name}_UNPROC_{current_time}.mp4"
 proc_file_path = os.path.join(output_dir, processed_output_filename)
 unproc_file_path = os.path.join(output_dir, unprocessed_output_filename)
 
+# DETECTIONS_ONLY=1 skips drawing and encoding and only writes the detection log
+detections_only = detections_only_from_env()
+detection_log = DetectionLog(detection_log_path(os.path.splitext(proc_file_path)[0])) if detections_only else None
 fourcc = cv2.VideoWriter_fourcc(*"avc1")
-proc_out = cv2.VideoWriter(
-    proc_file_path, fourcc, source_fps, (frame_width, frame_height)
+proc_out = None if detections_only else writer_from_env(
+    proc_file_path, fourcc, sampler.output_fps, (frame_width, frame_height)
 )
-# unproc_out = cv2.VideoWriter(unproc_file_path, fourcc, source_fps, (frame_width, frame_height))
-
-detection_interval = 1
+# ASYNC_IO=1 decodes ahead and encodes in background threads, so inference never waits on I/O
+if proc_out:
+    proc_out = async_writer_from_env(proc_out)
+prefetch = prefetch_from_env(sampler.read)
+reader = prefetch or sampler
+# unproc_out = writer_from_env(unproc_file_path, fourcc, source_fps, (frame_width, frame_height))
+
+detection_interval = int(os.getenv("DETECTION_INTERVAL", "1"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+# Tunes detection_interval (and optionally the inference size) at runtime when ADAPTIVE_INTERVAL=1
+controller = controller_from_env(sampler.output_fps)
+# Frames decoded ahead and sent through the model together; offline footage has no latency budget
+batch_size = max(1, int(os.getenv("INFERENCE_BATCH", "1")))
+
+# Reuses the previous detections on static frames when MOTION_GATE=1
+motion_gate = motion_gate_from_env()
+frame_index = 0
+# No GUI calls when HEADLESS=1; PREVIEW_PORT serves an MJPEG preview instead
+display = display_from_env()
 
 # Create a tqdm progress bar
 pbar = tqdm(total=total_frames, desc="Processing Frames")
 
 try:
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        batch = reader.read_batch(batch_size)
+        if not batch:
             logging.info("End of video file reached.")
             break
-
-        update_detection = (total_frames % detection_interval) == 0
-        processed_frame = detect_objects(frame, update_detection)
-
-        # unproc_out.write(frame)  # Save original frame to unprocessed video
-        proc_out.write(processed_frame)  # Save processed frame to processed video
-
-        pbar.update(1)  # Update the progress bar by one step
-
-        if cv2.waitKey(1) & 0xFF == ord("q"):
+        indices = [index for index, _ in batch]
+        frames = [frame for _, frame in batch]
+
+        batch_start = time.perf_counter()
+        update_flags = []
+        for frame in frames:
+            if controller:
+                update_detection = controller.should_detect()
+            else:
+                update_detection = ((frame_index + len(update_flags)) % detection_interval) == 0
+            if update_detection and motion_gate:
+                update_detection = motion_gate.should_infer(frame)
+            update_flags.append(update_detection)
+        processed_frames = detect_objects(frames, update_flags, indices)
+
+        for processed_frame in processed_frames:
+            proc_out.write(processed_frame)  # Save processed frame to processed video
+            display.publish(processed_frame)
+        frame_seconds = (time.perf_counter() - batch_start) / len(frames)
+        if controller:
+            for update_detection in update_flags:
+                controller.record_frame(frame_seconds, last_inference_time if update_detection else None)
+        frame_index += len(frames)
+        pbar.update(indices[-1] + 1 - pbar.n)  # Skipped frames count as done too
+        if prefetch:
+            # Full decode queue: inference is the bottleneck; full write queue: encoding is
+            pbar.set_postfix(decode_queue=prefetch.depth(), write_queue=proc_out.depth() if proc_out else 0)
+
+        if display.poll_key() == ord("q"):
             break
 except KeyboardInterrupt:
     logging.info("Interrupted by user.")
 finally:
+    if prefetch:
+        prefetch.stop()
     cap.release()
-    proc_out.release()
+    if proc_out:
+        proc_out.release()
+    if detection_log:
+        detection_log.close()
     # unproc_out.release()
-    cv2.destroyAllWindows()
+    display.close()
     pbar.close()  # Close the progress bar
 
     # Log the full path of the output files
     logging.info(f"Video {video_path} processing concluded.")
-    logging.info(f"Processed video saved to: {os.path.abspath(proc_file_path)}")
+    if motion_gate:
+        logging.info(f"Motion gate: {motion_gate.format_report()}")
+    if cascade:
+        logging.info(f"Cascade: {cascade.format_report()}")
+    if detection_log:
+        logging.info(f"{detection_log.rows} detections saved to: {os.path.abspath(detection_log.path)}")
+    else:
+        logging.info(f"Processed video saved to: {os.path.abspath(proc_file_path)}")
     # logging.info(f"Unprocessed video saved to: {os.path.abspath(unproc_file_path)}")
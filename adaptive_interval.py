@@ -0,0 +1,128 @@
+import logging
+import math
+import os
+from collections import deque
+
+
+class AdaptiveIntervalController:
+    """
+    Closed-loop controller for detection_interval (and optionally the inference size).
+
+    It keeps a rolling window of inference latencies and of the per-frame time spent
+    outside inference, and picks the smallest interval that still holds the target
+    output FPS. When even max_interval cannot keep up, it steps the inference size
+    down; when there is plenty of headroom at interval 1, it steps the size back up.
+
+    Parameters:
+    - source_fps: FPS of the incoming video, used as the target when none is given.
+    - target_fps: Output FPS to hold.
+    - min_interval, max_interval: Bounds for detection_interval.
+    - sizes: Optional inference sizes to choose from, e.g. (640, 512, 416, 320).
+    - size: Starting inference size (must be in sizes when sizes are given).
+    - window: Number of samples in the rolling latency windows.
+    - cooldown: Frames to wait between two decisions.
+    """
+
+    def __init__(self, source_fps, target_fps=None, min_interval=1, max_interval=30,
+                 sizes=None, size=640, window=30, cooldown=15):
+        self.source_fps = source_fps if source_fps and source_fps > 0 else 30.0
+        self.target_fps = target_fps if target_fps and target_fps > 0 else self.source_fps
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.sizes = sorted(sizes, reverse=True) if sizes else None
+        self.size = size if not self.sizes or size in self.sizes else self.sizes[0]
+        self.cooldown = cooldown
+
+        self.interval = self.min_interval
+        self.inference_times = deque(maxlen=window)
+        self.overhead_times = deque(maxlen=window)
+        self.frames_since_detection = None
+        self.frames_since_decision = 0
+
+    def should_detect(self):
+        """Call once per frame; True when this frame is a keyframe."""
+        if self.frames_since_detection is None or self.frames_since_detection + 1 >= self.interval:
+            self.frames_since_detection = 0
+            return True
+        self.frames_since_detection += 1
+        return False
+
+    def record_frame(self, frame_seconds, inference_seconds=None):
+        """
+        Feed the timing of the frame that was just produced.
+
+        Parameters:
+        - frame_seconds: Wall time spent on the whole frame.
+        - inference_seconds: Time spent in the model, None on non-keyframes.
+        """
+        if inference_seconds is not None:
+            self.inference_times.append(inference_seconds)
+        self.overhead_times.append(max(frame_seconds - (inference_seconds or 0.0), 0.0))
+
+        self.frames_since_decision += 1
+        if self.frames_since_decision >= self.cooldown and len(self.inference_times) >= 3:
+            self.frames_since_decision = 0
+            self._decide()
+
+    def _decide(self):
+        inference = sum(self.inference_times) / len(self.inference_times)
+        overhead = sum(self.overhead_times) / len(self.overhead_times)
+        budget = 1.0 / self.target_fps - overhead
+
+        # Inference cost is amortised over the interval: inference / interval <= budget
+        wanted = math.ceil(inference / budget) if budget > 0 else self.max_interval + 1
+        interval = min(max(wanted, self.min_interval), self.max_interval)
+
+        if interval != self.interval:
+            logging.info(
+                f"Adaptive interval: {self.interval} -> {interval} "
+                f"(inference {inference * 1000:.1f}ms, overhead {overhead * 1000:.1f}ms, "
+                f"target {self.target_fps:.1f} FPS)"
+            )
+            self.interval = interval
+
+        if not self.sizes:
+            return
+        index = self.sizes.index(self.size)
+        if wanted > self.max_interval and index + 1 < len(self.sizes):
+            self._set_size(self.sizes[index + 1], inference)
+        elif wanted <= self.min_interval and index > 0:
+            # Latency grows roughly with the pixel count, keep 20% headroom before scaling up
+            larger = self.sizes[index - 1]
+            predicted = inference * (larger / self.size) ** 2
+            if budget > 0 and predicted / self.min_interval <= 0.8 * budget:
+                self._set_size(larger, inference)
+
+    def _set_size(self, size, inference):
+        logging.info(
+            f"Adaptive interval: inference size {self.size} -> {size} "
+            f"(interval {self.interval}, inference {inference * 1000:.1f}ms)"
+        )
+        self.size = size
+        # Old latencies were measured at the previous size
+        self.inference_times.clear()
+
+
+def controller_from_env(source_fps):
+    """
+    Build a controller from the ADAPTIVE_* settings, or None when ADAPTIVE_INTERVAL is off.
+    Call it after load_dotenv() so the .env values are visible.
+    """
+    if os.getenv("ADAPTIVE_INTERVAL", "0") != "1":
+        return None
+    target_fps = float(os.getenv("TARGET_FPS", "0")) or None
+    sizes = None
+    if os.getenv("ADAPTIVE_SIZE", "0") == "1":
+        sizes = [int(s) for s in os.getenv("ADAPTIVE_SIZES", "640,512,416,320").split(",")]
+    controller = AdaptiveIntervalController(
+        source_fps,
+        target_fps=target_fps,
+        max_interval=int(os.getenv("MAX_DETECTION_INTERVAL", "30")),
+        sizes=sizes,
+        size=int(os.getenv("INFERENCE_SIZE", "640")),
+    )
+    logging.info(
+        f"Adaptive interval enabled: target {controller.target_fps:.1f} FPS, "
+        f"interval {controller.min_interval}-{controller.max_interval}, sizes {sizes or [controller.size]}"
+    )
+    return controller
@@ -0,0 +1,214 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import psutil
+from dotenv import load_dotenv
+
+from benchmark_onnx import compare
+from detection_cache import detections_from_results
+from frame_sources import load_frames
+from model_registry import load_model
+from tuning_profile import machine_fingerprint, profile_path
+
+# Tune inference for this machine on a sample video and save the result as the
+# profile that the processing scripts load at start-up (see tuning_profile.py).
+#
+#   AUTOTUNE_VIDEO=gopro_footage/sample.mp4 python autotune.py
+#
+# The sweep runs in stages, each keeping the best value so far: input size (the
+# smallest that still finds AUTOTUNE_MIN_RECALL of the boxes found at the largest),
+# intra-op threads, inter-op threads (torch only), batch size, and finally the number
+# of worker processes sharing the cores. Every measurement runs in a fresh process,
+# because torch's thread pools cannot be resized once they are in use.
+load_dotenv()
+model_name = os.getenv("AUTOTUNE_MODEL", os.getenv("MODEL_NAME", "yolov5x"))
+backend = os.getenv("INFERENCE_BACKEND", "torch")
+video_path = os.getenv("AUTOTUNE_VIDEO", os.getenv("VIDEO_PATH", ""))
+num_frames = int(os.getenv("AUTOTUNE_FRAMES", "32"))
+min_recall = float(os.getenv("AUTOTUNE_MIN_RECALL", "0.9"))
+cpu_count = os.cpu_count() or 1
+
+
+def int_list(name, default):
+    value = os.getenv(name, "")
+    return sorted({int(item) for item in value.split(",")}) if value else default
+
+
+powers_of_two = [2 ** i for i in range(cpu_count.bit_length()) if 2 ** i <= cpu_count]
+sizes = int_list("AUTOTUNE_SIZES", [320, 416, 512, 640])
+thread_counts = int_list("AUTOTUNE_THREADS", sorted(set(powers_of_two) | {cpu_count}))
+interop_counts = int_list("AUTOTUNE_INTEROP_THREADS", [count for count in (1, 2, 4) if count <= cpu_count])
+batch_sizes = int_list("AUTOTUNE_BATCH_SIZES", [1, 2, 4, 8])
+process_counts = int_list("AUTOTUNE_PROCESSES", powers_of_two)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def measure(config, barrier=None):
+    """
+    Time one configuration in this process (a fresh one from run()).
+
+    Parameters:
+    - config: dict with backend, size, batch, threads and interop.
+    - barrier: Shared barrier so that concurrent workers start timing together.
+
+    Returns:
+    - dict with the frames processed, wall-clock start and end, resident memory and
+      the detections of every frame.
+    """
+    import torch
+
+    cv2.setNumThreads(1)
+    if config["backend"] == "onnx":
+        os.environ["ONNX_THREADS"] = str(config["threads"])
+    else:
+        torch.set_num_threads(config["threads"])
+        torch.set_num_interop_threads(config["interop"])
+    model = load_model(model_name, backend=config["backend"])
+    frames = load_frames(video_path, num_frames)
+    size, batch = config["size"], config["batch"]
+    model(frames[:batch], size=size)  # Untimed warm-up
+
+    if barrier is not None:
+        barrier.wait()
+    detections = []
+    start = time.time()
+    with torch.no_grad():
+        for i in range(0, len(frames), batch):
+            chunk = frames[i:i + batch]
+            results = model(chunk, size=size)
+            detections.extend(detections_from_results(results, index) for index in range(len(chunk)))
+    end = time.time()
+    return {
+        "frames": len(frames),
+        "start": start,
+        "end": end,
+        "rss": psutil.Process().memory_info().rss,
+        "detections": detections,
+    }
+
+
+def run(configs):
+    """
+    Run the configurations side by side, one fresh process each.
+
+    Returns:
+    - (frames per second over all of them, the first one's result).
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(configs), mp_context=context) as pool:
+        if len(configs) == 1:
+            results = [pool.submit(measure, configs[0]).result()]
+        else:
+            with context.Manager() as manager:
+                barrier = manager.Barrier(len(configs))
+                futures = [pool.submit(measure, config, barrier) for config in configs]
+                results = [future.result() for future in futures]
+    elapsed = max(result["end"] for result in results) - min(result["start"] for result in results)
+    return sum(result["frames"] for result in results) / elapsed, results[0]
+
+
+def main():
+    # Registered (and exported or quantized) once here, so the workers only load it
+    load_model(model_name, backend=backend)
+    logging.info(f"Tuning {model_name} ({backend}) on {cpu_count} cores with {num_frames} frames of "
+                 f"{video_path or 'random noise'}")
+    measurements = []
+
+    def record(stage, config, processes, fps, **extra):
+        measurements.append({"stage": stage, **{k: v for k, v in config.items() if k != "backend"},
+                             "processes": processes, "fps": round(fps, 2), **extra})
+        details = "".join(f"  {key} {value}" for key, value in extra.items())
+        logging.info(
+            f"{stage:<9} size {config['size']:>4}  batch {config['batch']:>2}  threads {config['threads']:>3}  "
+            f"interop {config['interop']:>2}  processes {processes:>3}  {fps:7.2f} FPS{details}"
+        )
+
+    best = {"backend": backend, "size": max(sizes), "batch": 1, "threads": cpu_count, "interop": 1}
+
+    # Input size: the fastest one that still finds most of what the largest finds
+    reference, candidates = None, []
+    for size in sorted(sizes, reverse=True):
+        config = dict(best, size=size)
+        fps, result = run([config])
+        recall = 1.0
+        if reference is None:
+            reference = result["detections"]
+            memory = result["rss"]
+        else:
+            matched, total, _, _, _ = compare(reference, result["detections"])
+            recall = matched / total if total else 1.0
+        record("size", config, 1, fps, recall=round(recall, 3))
+        if recall >= min_recall:
+            candidates.append((fps, size))
+    if not sum(len(found) for found in reference):
+        logging.warning("Nothing was detected at the largest size, so smaller sizes cannot be checked; keeping it.")
+        candidates = candidates[:1]
+    best_fps, best["size"] = max(candidates)
+
+    def sweep(stage, key, values):
+        if values == [best[key]]:
+            return best_fps
+        results = []
+        for value in values:
+            config = dict(best, **{key: value})
+            fps, _ = run([config])
+            record(stage, config, 1, fps)
+            results.append((fps, value))
+        best[key] = max(results)[1]
+        return max(results)[0]
+
+    best_fps = sweep("threads", "threads", thread_counts)
+    if backend != "onnx":
+        best_fps = sweep("interop", "interop", interop_counts)
+    best_fps = sweep("batch", "batch", batch_sizes)
+
+    # Worker processes sharing the cores, as far as the memory allows
+    best_processes, best_worker_threads = 1, best["threads"]
+    max_processes = max(1, int(psutil.virtual_memory().available * 0.8 // max(memory, 1)))
+    for processes in process_counts:
+        if processes == 1:
+            continue
+        if processes > max_processes:
+            logging.info(f"Skipping {processes} processes: not enough memory for that many models.")
+            continue
+        config = dict(best, threads=max(1, cpu_count // processes))
+        fps, _ = run([config] * processes)
+        record("processes", config, processes, fps)
+        if fps > best_fps:
+            best_fps, best_processes, best_worker_threads = fps, processes, config["threads"]
+
+    settings = {
+        "INFERENCE_SIZE": best["size"],
+        "INFERENCE_BATCH": best["batch"],
+        "PARALLEL_WORKERS": best_processes,
+        "BATCH_JOBS": best_processes,
+        "WORKER_THREADS": best_worker_threads,
+    }
+    if backend == "onnx":
+        settings["ONNX_THREADS"] = best["threads"]
+    else:
+        settings["TORCH_THREADS"] = best["threads"]
+        settings["TORCH_INTEROP_THREADS"] = best["interop"]
+    profile = {
+        "machine": machine_fingerprint(),
+        "model": model_name,
+        "backend": backend,
+        "video": video_path,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": settings,
+        "measurements": measurements,
+    }
+    path = profile_path()
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    logging.info(f"Best: {settings} ({best_fps:.2f} FPS). Profile saved to {os.path.abspath(path)}")
+
+
+if __name__ == "__main__":
+    main()
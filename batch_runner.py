@@ -0,0 +1,210 @@
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+from dotenv import load_dotenv
+
+from detection_log import detection_log_path, detections_only_from_env
+from model_registry import ensure_registered
+from parallel_video import concat_detections, concat_videos, process_chunk, registry_name
+from tuning_profile import apply_profile
+
+# Process every video of a directory or glob, keeping per-video progress in a manifest
+# so that an interrupted run picks up where it stopped.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+load_dotenv()
+apply_profile(set_threads=False)
+batch_input = os.getenv("BATCH_INPUT", "gopro_footage")  # Directory or glob pattern
+output_dir = os.getenv("OUTPUT_DIR", "output_videos")
+manifest_path = os.getenv("BATCH_MANIFEST", os.path.join(output_dir, "batch_manifest.json"))
+concurrent_videos = int(os.getenv("BATCH_JOBS", "1"))
+# Frames per checkpoint: a crash loses at most this much work on each running video
+checkpoint_frames = int(os.getenv("CHECKPOINT_FRAMES", "1800"))
+model_name = os.getenv("MODEL_NAME", "yolov5x")  # Hub model name, or 'custom' together with MODEL_WEIGHTS
+model_weights = os.getenv("MODEL_WEIGHTS", "")
+model_conf = float(os.getenv("MODEL_CONF", "0.45"))
+detection_interval = int(os.getenv("DETECTION_INTERVAL", "1"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+worker_threads = int(os.getenv("WORKER_THREADS", "0")) or max(1, (os.cpu_count() or 1) // concurrent_videos)
+video_extensions = (".mp4", ".avi", ".mov")
+detections_only = detections_only_from_env()  # No rendered videos, only the detection logs
+
+
+def find_videos(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*")
+    return sorted(
+        os.path.abspath(path) for path in glob.glob(pattern) if path.lower().endswith(video_extensions)
+    )
+
+
+class BatchManifest:
+    """
+    Per-video status of a batch run, saved as JSON after every change.
+
+    Each entry holds the status (pending, running, done, failed), the frame count,
+    frames processed so far, the checkpoints (frame ranges) already on disk and the
+    output paths. Saving goes through a temporary file so a crash never leaves a
+    half-written manifest behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.videos = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.videos = json.load(f)["videos"]
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"updated": time.strftime("%Y-%m-%d %H:%M:%S"), "videos": self.videos}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, video_path, output_base):
+        if video_path not in self.videos:
+            self.videos[video_path] = {
+                "status": "pending", "frames_total": None, "frames_processed": 0,
+                "checkpoints": [], "output": output_base + ".mp4", "detections": detection_log_path(output_base),
+            }
+        return self.videos[video_path]
+
+    def update(self, video_path, **fields):
+        self.videos[video_path].update(fields)
+        self.save()
+
+    def counts(self):
+        counts = {}
+        for entry in self.videos.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+class VideoJob:
+    """Checkpoint ranges of one video that still have to be processed."""
+
+    def __init__(self, video_path, entry):
+        self.video_path = video_path
+        self.entry = entry
+        self.base = os.path.splitext(entry["output"])[0]
+        self.parts_dir = self.base + "_parts"
+        self.log_extension = os.path.splitext(entry["detections"])[1]
+        cap = cv2.VideoCapture(video_path)
+        self.opened = cap.isOpened()
+        self.total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        self.ranges = [(start, min(start + checkpoint_frames, self.total))
+                       for start in range(0, self.total, checkpoint_frames)]
+        done = {tuple(checkpoint) for checkpoint in entry["checkpoints"]}
+        self.remaining = [r for r in self.ranges if r not in done]
+
+    def part_path(self, start, extension):
+        return os.path.join(self.parts_dir, f"part{start:09d}{extension}")
+
+    def next_chunk(self):
+        start, end = self.remaining.pop(0)
+        return {
+            "video_path": self.video_path, "start": start, "end": end,
+            "video_out": self.part_path(start, ".mp4"), "detections_out": self.part_path(start, self.log_extension),
+            "model_name": model_name, "model_weights": model_weights, "model_conf": model_conf,
+            "interval": detection_interval, "size": inference_size, "threads": worker_threads,
+            "render": not detections_only,
+        }
+
+    def finish(self):
+        """Join the checkpoints into the final video and detection file."""
+        if not detections_only:
+            concat_videos([self.part_path(start, ".mp4") for start, _ in self.ranges], self.entry["output"],
+                          self.fps, self.size)
+        rows = concat_detections([self.part_path(start, self.log_extension) for start, _ in self.ranges],
+                                 self.entry["detections"])
+        shutil.rmtree(self.parts_dir)
+        return rows
+
+
+def main():
+    videos = find_videos(batch_input)
+    if not videos:
+        logging.error(f"No videos found in {batch_input}.")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BatchManifest(manifest_path)
+    label = "custom" if model_weights else model_name
+    for video_path in videos:
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        manifest.add(video_path, os.path.join(output_dir, f"{stem}_{label}_PROC"))
+    manifest.save()
+
+    todo = [path for path in videos if manifest.videos[path]["status"] != "done"]
+    logging.info(
+        f"{len(videos)} videos in {batch_input}, {len(videos) - len(todo)} already done, "
+        f"running {concurrent_videos} at a time. Manifest: {os.path.abspath(manifest_path)}"
+    )
+
+    # Built once here, so the workers only load the pre-built copy
+    ensure_registered(registry_name(model_name, model_weights))
+    # spawn: torch and OpenCV thread pools do not survive a fork reliably
+    context = multiprocessing.get_context("spawn")
+    running = {}  # future -> VideoJob
+    pool = ProcessPoolExecutor(max_workers=concurrent_videos, mp_context=context)
+
+    def start_next_video():
+        while todo:
+            video_path = todo.pop(0)
+            job = VideoJob(video_path, manifest.videos[video_path])
+            if not job.opened or not job.total:
+                manifest.update(video_path, status="failed", error="cannot open video")
+                logging.error(f"Cannot open {video_path}, skipped.")
+                continue
+            os.makedirs(job.parts_dir, exist_ok=True)
+            manifest.update(video_path, status="running", frames_total=job.total)
+            if job.remaining:
+                logging.info(f"Resuming {video_path} at frame {job.remaining[0][0]}" if job.entry["checkpoints"]
+                             else f"Starting {video_path}")
+                running[pool.submit(process_chunk, job.next_chunk())] = job
+                return
+            finish_video(job)
+
+    def finish_video(job):
+        rows = job.finish()
+        manifest.update(job.video_path, status="done", error=None)
+        logging.info(f"Finished {job.video_path}: {job.total} frames, {rows} detections.")
+
+    try:
+        for _ in range(concurrent_videos):
+            start_next_video()
+        while running:
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    manifest.update(job.video_path, status="failed", error=str(e))
+                    logging.error(f"Failed to process {job.video_path}: {e}")
+                    start_next_video()
+                    continue
+                job.entry["checkpoints"].append([result["start"], result["end"]])
+                manifest.update(job.video_path, frames_processed=job.entry["frames_processed"] + result["frames"])
+                if job.remaining:
+                    running[pool.submit(process_chunk, job.next_chunk())] = job
+                else:
+                    finish_video(job)
+                    start_next_video()
+    except KeyboardInterrupt:
+        logging.info("Interrupted by user; completed checkpoints are kept and the next run resumes from them.")
+    finally:
+        pool.shutdown(cancel_futures=True)
+        logging.info(f"Batch status: {manifest.counts()}")
+
+
+if __name__ == "__main__":
+    main()
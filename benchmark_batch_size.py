@@ -0,0 +1,42 @@
+import logging
+import os
+import time
+
+import torch
+from dotenv import load_dotenv
+
+from frame_sources import load_frames
+from model_registry import load_model
+
+# Frames per second of one model on CPU against the number of frames per forward pass.
+load_dotenv()
+model_name = os.getenv("BENCH_MODEL", "yolov5s")
+video_path = os.getenv("BENCH_VIDEO", os.getenv("VIDEO_PATH", ""))
+batch_sizes = [int(size) for size in os.getenv("BENCH_BATCH_SIZES", "1,2,4,8,16").split(",")]
+num_frames = int(os.getenv("BENCH_FRAMES", "64"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main():
+    model = load_model(model_name).cpu()
+    model.eval()
+    frames = load_frames(video_path, num_frames)
+    logging.info(f"{model_name} on CPU at size {inference_size}, {torch.get_num_threads()} threads")
+
+    # One untimed pass so lazy initialisation is not charged to the first batch size
+    model(frames[:1], size=inference_size)
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            for i in range(0, len(frames), batch_size):
+                model(frames[i:i + batch_size], size=inference_size)
+            elapsed = time.perf_counter() - start
+            logging.info(
+                f"batch {batch_size:>3}: {len(frames) / elapsed:6.1f} FPS  {elapsed * 1000 / len(frames):7.1f} ms/frame"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+from dotenv import load_dotenv
+
+import onnx_backend
+from detection_cache import box_iou, detections_from_results
+from frame_sources import load_frames
+from model_registry import load_model
+
+# Latency of the torch and ONNX Runtime backends side by side, and how closely the
+# ONNX detections match the torch ones on the same frames.
+load_dotenv()
+model_name = os.getenv("BENCH_MODEL", "yolov5s")
+video_path = os.getenv("BENCH_VIDEO", os.getenv("VIDEO_PATH", ""))
+num_frames = int(os.getenv("BENCH_FRAMES", "64"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+conf = float(os.getenv("BENCH_CONF", "0.25"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def run(model, frames):
+    """Detections of every frame, one frame per call, and the mean ms per frame."""
+    model(frames[0], size=inference_size)  # Untimed warm-up
+    detections = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for frame in frames:
+            detections.append(detections_from_results(model(frame, size=inference_size)))
+    return detections, (time.perf_counter() - start) * 1000 / len(frames)
+
+
+def compare(reference, candidate, threshold=0.5):
+    """
+    Greedy one-to-one matching of same-class boxes at IoU >= threshold.
+
+    Returns:
+    - (matched, reference boxes, candidate boxes, IoUs of the matches, confidence differences).
+    """
+    matched, ious, conf_deltas = 0, [], []
+    for ref, cand in zip(reference, candidate):
+        if not len(ref) or not len(cand):
+            continue
+        iou = box_iou(ref, cand) * (ref[:, 5:6] == cand[None, :, 5])
+        for _ in range(min(len(ref), len(cand))):
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            if iou[i, j] < threshold:
+                break
+            matched += 1
+            ious.append(iou[i, j])
+            conf_deltas.append(abs(ref[i, 4] - cand[j, 4]))
+            iou[i, :] = 0
+            iou[:, j] = 0
+    total_ref = sum(len(ref) for ref in reference)
+    total_cand = sum(len(cand) for cand in candidate)
+    return matched, total_ref, total_cand, ious, conf_deltas
+
+
+def main():
+    if onnx_backend.ort is None:
+        logging.error("onnxruntime is not installed (pip install onnxruntime).")
+        return
+    frames = load_frames(video_path, num_frames)
+    if not video_path:
+        logging.warning("Without BENCH_VIDEO the frames are random noise: the accuracy figures mean little")
+    torch_model = load_model(model_name, backend="torch").cpu()
+    torch_model.eval()
+    onnx_model = load_model(model_name, backend="onnx")
+    torch_model.conf = onnx_model.conf = conf
+    logging.info(f"{model_name} on CPU at size {inference_size}, confidence {conf}, {len(frames)} frames")
+
+    torch_detections, torch_ms = run(torch_model, frames)
+    onnx_detections, onnx_ms = run(onnx_model, frames)
+    logging.info(f"torch:        {torch_ms:7.1f} ms/frame  {1000 / torch_ms:6.1f} FPS")
+    logging.info(f"onnxruntime:  {onnx_ms:7.1f} ms/frame  {1000 / onnx_ms:6.1f} FPS  ({torch_ms / onnx_ms:.2f}x)")
+
+    matched, total_torch, total_onnx, ious, conf_deltas = compare(torch_detections, onnx_detections)
+    logging.info(
+        f"Boxes: {total_torch} torch, {total_onnx} onnx, {matched} matched at IoU 0.5 "
+        f"({matched / max(total_torch, 1):.1%} of torch, {matched / max(total_onnx, 1):.1%} of onnx)"
+    )
+    if matched:
+        logging.info(
+            f"Matched boxes: mean IoU {np.mean(ious):.4f}, "
+            f"confidence difference mean {np.mean(conf_deltas):.4f} max {np.max(conf_deltas):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from box_propagation import BoxPropagator
+from detection_cache import box_iou, detections_from_results
+from frame_sources import read_batch
+from model_registry import load_model
+
+# IoU drift of propagated boxes against running the detector on every frame.
+load_dotenv()
+model_name = os.getenv("BENCH_MODEL", "yolov5s")
+video_path = os.getenv("BENCH_VIDEO", os.getenv("VIDEO_PATH", ""))
+num_frames = int(os.getenv("BENCH_FRAMES", "240"))
+intervals = [int(interval) for interval in os.getenv("BENCH_INTERVALS", "2,4,8,15").split(",")]
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def mean_best_iou(reference, predicted):
+    """Mean over the reference boxes of the best IoU with a predicted box of the same class."""
+    if not len(reference):
+        return None
+    if not len(predicted):
+        return 0.0
+    iou = box_iou(reference, predicted) * (reference[:, 5:6] == predicted[None, :, 5])
+    return float(iou.max(axis=1).mean())
+
+
+def evaluate(frames, reference, interval, propagator):
+    """
+    Keyframes take the reference detections, the frames in between get propagated
+    (or, without a propagator, frozen) boxes.
+
+    Returns:
+    - (mean IoU on the frames in between, propagation ms per frame).
+    """
+    scores, elapsed, count = [], 0.0, 0
+    detections = reference[0]
+    for index, frame in enumerate(frames):
+        if index % interval == 0:
+            detections = reference[index]
+            if propagator:
+                propagator.reset(frame, detections)
+            continue
+        if propagator:
+            start = time.perf_counter()
+            detections = propagator.propagate(frame)
+            elapsed += time.perf_counter() - start
+            count += 1
+        score = mean_best_iou(reference[index], detections)
+        if score is not None:
+            scores.append(score)
+    return (np.mean(scores) if scores else float("nan")), (elapsed * 1000 / count if count else 0.0)
+
+
+def main():
+    if not video_path:
+        logging.error("Set BENCH_VIDEO or VIDEO_PATH to a recorded flight.")
+        return
+    cap = cv2.VideoCapture(video_path)
+    frames = read_batch(cap, num_frames)
+    cap.release()
+    if not frames:
+        logging.error(f"Could not read {video_path}.")
+        return
+
+    model = load_model(model_name)
+    logging.info(f"Running {model_name} on all {len(frames)} frames for the reference boxes")
+    start = time.perf_counter()
+    reference = [
+        detections_from_results(model(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), size=inference_size))
+        for frame in frames
+    ]
+    inference_ms = (time.perf_counter() - start) * 1000 / len(frames)
+    logging.info(f"Full inference: {inference_ms:.1f} ms/frame")
+
+    for interval in intervals:
+        for label, propagator in (("frozen", None), ("flow", BoxPropagator("flow")),
+                                  ("homography", BoxPropagator("homography"))):
+            iou, propagate_ms = evaluate(frames, reference, interval, propagator)
+            cost = (inference_ms + (interval - 1) * propagate_ms) / interval
+            logging.info(
+                f"interval {interval:>2} {label:<10} mean IoU {iou:.3f}  "
+                f"{propagate_ms:5.1f} ms/propagated frame  {cost:6.1f} ms/frame on average"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from video_writers import FFmpegPipeWriter, probe_encoders
+
+# Compare cv2.VideoWriter with the ffmpeg pipe writer on synthetic frames.
+load_dotenv()
+width = int(os.getenv("BENCH_WIDTH", "1920"))
+height = int(os.getenv("BENCH_HEIGHT", "1080"))
+num_frames = int(os.getenv("BENCH_FRAMES", "300"))
+fps = 30.0
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def synthetic_frames(count):
+    """A moving gradient with some noise: compressible, but not trivially so."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    noise = rng.integers(0, 24, size=(height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        base = ((x + y + i * 4) % 256).astype(np.uint8)
+        frame = np.dstack((base, np.roll(base, i * 8, axis=1), 255 - base))
+        frames.append(cv2.add(frame, noise))
+    return frames
+
+
+def run(name, make_writer, frames, path):
+    writer = make_writer(path)
+    if not writer.isOpened():
+        logging.info(f"{name:<28} not available")
+        return
+    start = time.perf_counter()
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    elapsed = time.perf_counter() - start
+    size_mb = os.path.getsize(path) / 1e6 if os.path.exists(path) else 0.0
+    logging.info(f"{name:<28} {len(frames) / elapsed:7.1f} FPS  {elapsed * 1000 / len(frames):6.2f} ms/frame  {size_mb:6.1f} MB")
+
+
+def main():
+    frames = synthetic_frames(num_frames)
+    size = (width, height)
+    logging.info(f"Encoding {num_frames} synthetic {width}x{height} frames")
+    with tempfile.TemporaryDirectory() as tmp:
+        for fourcc in ("avc1", "mp4v", "XVID", "MJPG"):
+            ext = ".avi" if fourcc in ("XVID", "MJPG") else ".mp4"
+            run(f"cv2.VideoWriter {fourcc}",
+                lambda p, f=fourcc: cv2.VideoWriter(p, cv2.VideoWriter_fourcc(*f), fps, size),
+                frames, os.path.join(tmp, f"opencv_{fourcc}{ext}"))
+
+        if not shutil.which("ffmpeg"):
+            logging.info("ffmpeg not found, skipping the ffmpeg pipe writer.")
+            return
+        for encoder in probe_encoders():
+            presets = ("ultrafast", "veryfast", "medium") if encoder in ("libx264", "libx265") else ("default",)
+            for preset in presets:
+                run(f"ffmpeg {encoder} {preset}",
+                    lambda p, e=encoder, pr=preset: FFmpegPipeWriter(p, fps, size, codec=e, preset=pr),
+                    frames, os.path.join(tmp, f"ffmpeg_{encoder}_{preset}.mp4"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from detection_cache import EMPTY_DETECTIONS
+
+# Sparse Lucas-Kanade settings: a small pyramid is enough on a downscaled frame
+_LK_PARAMS = dict(winSize=(21, 21), maxLevel=3, criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+
+class BoxPropagator:
+    """
+    Carries the last keyframe's boxes forward to the frames in between.
+
+    Corners are tracked with sparse Lucas-Kanade optical flow from the previous
+    frame to the current one on a downscaled grayscale copy. In "flow" mode each
+    box moves by the median displacement of the points inside it and is rescaled
+    by their median spread ratio, so objects moving on their own are followed too.
+    Boxes with too few tracked points fall back to the global camera motion. In
+    "homography" mode every box is moved with a single RANSAC homography of the
+    whole frame, which is cheaper and suits a panning drone over a static scene.
+
+    Parameters:
+    - method: "flow" or "homography".
+    - width: Width of the frame copy that is tracked.
+    - max_corners: Points tracked per frame.
+    - min_points: Points a box needs for its own motion in "flow" mode.
+    """
+
+    def __init__(self, method="flow", width=640, max_corners=400, min_points=4):
+        self.method = method
+        self.width = width
+        self.max_corners = max_corners
+        self.min_points = min_points
+        self.previous = None
+        self.scale = 1.0
+        self.detections = EMPTY_DETECTIONS
+
+    def _gray(self, frame):
+        height, width = frame.shape[:2]
+        self.scale = min(1.0, self.width / width)
+        if self.scale < 1.0:
+            frame = cv2.resize(frame, (self.width, int(height * self.scale)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def reset(self, frame, detections):
+        """Start from a keyframe and its fresh detections."""
+        self.previous = self._gray(frame)
+        self.detections = detections
+
+    def propagate(self, frame):
+        """
+        Returns:
+        - The previous detections moved onto `frame`, as an (N, 6) array.
+        """
+        gray = self._gray(frame)
+        previous, self.previous = self.previous, gray
+        if previous is None or not len(self.detections) or previous.shape != gray.shape:
+            return self.detections
+
+        points = cv2.goodFeaturesToTrack(previous, self.max_corners, 0.01, 7)
+        if points is None or len(points) < self.min_points:
+            return self.detections
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, gray, points, None, **_LK_PARAMS)
+        tracked = status.ravel() == 1
+        if tracked.sum() < self.min_points:
+            return self.detections
+        # Back to full-resolution coordinates
+        start = points.reshape(-1, 2)[tracked] / self.scale
+        end = moved.reshape(-1, 2)[tracked] / self.scale
+
+        homography, _ = cv2.findHomography(start, end, cv2.RANSAC, 3.0)
+        if self.method == "homography":
+            self.detections = self._warp(self.detections, homography)
+        else:
+            self.detections = self._follow(self.detections, start, end, homography)
+        return self.detections
+
+    def _warp(self, detections, homography):
+        if homography is None:
+            return detections
+        corners = detections[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 1, 2).astype(np.float32)
+        warped = cv2.perspectiveTransform(corners, homography).reshape(-1, 4, 2)
+        out = detections.copy()
+        out[:, 0:2] = warped.min(axis=1)
+        out[:, 2:4] = warped.max(axis=1)
+        return out
+
+    def _follow(self, detections, start, end, homography):
+        out = self._warp(detections, homography)
+        for i, (x1, y1, x2, y2) in enumerate(detections[:, :4]):
+            inside = (start[:, 0] >= x1) & (start[:, 0] <= x2) & (start[:, 1] >= y1) & (start[:, 1] <= y2)
+            if inside.sum() < self.min_points:
+                continue  # Keeps the global motion from _warp()
+            before, after = start[inside], end[inside]
+            shift = np.median(after - before, axis=0)
+            spread_before = np.linalg.norm(before - before.mean(axis=0), axis=1)
+            spread_after = np.linalg.norm(after - after.mean(axis=0), axis=1)
+            valid = spread_before > 1.0
+            scale = np.median(spread_after[valid] / spread_before[valid]) if valid.any() else 1.0
+            scale = float(np.clip(scale, 0.8, 1.25))
+            cx, cy = (x1 + x2) / 2 + shift[0], (y1 + y2) / 2 + shift[1]
+            half_w, half_h = (x2 - x1) / 2 * scale, (y2 - y1) / 2 * scale
+            out[i, :4] = (cx - half_w, cy - half_h, cx + half_w, cy + half_h)
+        return out
+
+
+def propagator_from_env():
+    """BoxPropagator configured from BOX_PROPAGATION_METHOD, or None unless BOX_PROPAGATION=1."""
+    if os.getenv("BOX_PROPAGATION", "0") != "1":
+        return None
+    propagator = BoxPropagator(method=os.getenv("BOX_PROPAGATION_METHOD", "flow"))
+    logging.info(f"Box propagation enabled: boxes follow the scene between keyframes ({propagator.method}).")
+    return propagator
@@ -6,13 +6,34 @@ from imutils.video import VideoStream
 import time
 import os
 from dotenv import load_dotenv
-import numpy as np
+from adaptive_interval import controller_from_env
+from box_propagation import propagator_from_env
+from detection_cache import DetectionCache
+from display_utils import ComparisonCanvas, display_from_env
+from frame_sources import LatestFrameReader
+from model_cascade import cascade_from_env
+from model_registry import load_model
+from motion_gate import motion_gate_from_env
+from stage_metrics import metrics_from_env
+from tiled_inference import tiled_detector_from_env
+from tuning_profile import apply_profile
+from video_writers import PassthroughRecorder, SegmentedWriter, writer_from_env
+
+# Initialize logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Load environment configurations
 load_dotenv()
+apply_profile()
 drone = os.getenv('DRONE_NAME', 'your_drone')
 output_dir = os.getenv('OUTPUT_DIR', 'output_videos')
 stream_url = os.getenv('STREAM_URL', 'rtmp://your_stream_url/live')
+live_ingest = os.getenv('LIVE_INGEST', '0') == '1'  # Always hand the detector the newest frame
+inference_size = int(os.getenv('INFERENCE_SIZE', '640'))
+# Unprocessed footage: 'encode' re-encodes decoded frames, 'passthrough' stream-copies with ffmpeg, 'off' skips it
+unproc_mode = os.getenv('UNPROC_MODE', 'encode')
+comparison_width = int(os.getenv('COMPARISON_DISPLAY_WIDTH', '0')) or None  # Downscale the side-by-side view
+save_comparison = os.getenv('SAVE_COMPARISON', '0') == '1'  # Also save the side-by-side view as a video
 
 print(f"Drone: {drone}", f"Output directory: {output_dir}", f"Stream URL: {stream_url}", torch.cuda.is_available(), sep='\n')
 model_repository = 'ultralytics/'
@@ -20,68 +41,123 @@ model_name = 'yolov8'  # 'yolov5n','yolov5s', 'yolov5m', 'yolov5l', 'yolov5x'
 
 proc_out_dir = os.path.join(output_dir, 'processed_footage')
 unproc_out_dir = os.path.join(output_dir, 'unprocessed_footage')
+comparison_out_dir = os.path.join(output_dir, 'comparison_footage')
 
 # Ensure the output directory exists
 os.makedirs(output_dir, exist_ok=True)
 os.makedirs(proc_out_dir, exist_ok=True)
 os.makedirs(unproc_out_dir, exist_ok=True)
+if save_comparison:
+    os.makedirs(comparison_out_dir, exist_ok=True)
 
-# Initialize logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info(f"Starting object detection with {model_name} on drone video stream!")
 
 try:
-    model = torch.hub.load(model_repository, model_name, pretrained=True).to('cuda')
+    model = load_model(model_name).to('cuda')  # Pre-built copy from the local model registry
     model.conf = 0.20
     logging.info(f"{model_name} model loaded successfully.")
 except Exception as e:
     logging.error(f"Failed to load model: {e}")
     exit()
 
-results = None
+# Last keyframe's boxes, drawn onto every following frame until the next keyframe
+detection_cache = DetectionCache(model.names)
+# Overlapping tiles at native resolution when TILED_INFERENCE=1, for small objects in 4K footage
+tiled_detector = tiled_detector_from_env(model)
+# Light model on every frame, this model only on uncertain or new objects when CASCADE=1
+cascade = cascade_from_env(model)
+# Moves the last keyframe's boxes with optical flow on the frames in between when BOX_PROPAGATION=1
+propagator = propagator_from_env()
+last_inference_time = None  # Seconds spent in the model on the latest keyframe, None otherwise
 
 def detect_objects(frame, update_detection):
-    global results
+    global last_inference_time
+    last_inference_time = None
     if update_detection:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = model(frame_rgb)
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    elif results:
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    else:
-        frame_bgr = frame
-    return frame_bgr
-
-# Initialization for FPS calculation
-frame_times = []
-frame_time_limit = 100  # Calculate average FPS over the last 100 frames
+        start = time.perf_counter()
+        with metrics.timer("preprocess"):
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with metrics.timer("inference"):
+            if tiled_detector:
+                detection_cache.update(tiled_detector(frame_rgb))
+            elif cascade:
+                detection_cache.update(cascade(frame_rgb, controller.size if controller else inference_size))
+            else:
+                results = model(frame_rgb, size=controller.size if controller else inference_size)
+                detection_cache.update_from_results(results)
+        last_inference_time = time.perf_counter() - start
+        if propagator:
+            propagator.reset(frame, detection_cache.detections)
+    elif propagator:
+        detection_cache.update(propagator.propagate(frame))
+    with metrics.timer("render"):
+        return detection_cache.draw(frame)
+
+# Initialization for FPS calculation and per-stage latency histograms
+frame_time_limit = 100  # Percentiles are computed over the last 100 frames of each stage
 default_fps = 30.0
+metrics = metrics_from_env(frame_time_limit)
+# GUI window, or nothing but the optional MJPEG preview when HEADLESS=1
+display = display_from_env()
 
 # Start video stream
-vs = VideoStream(stream_url).start()
-time.sleep(2.0)  # Warm-up time
+if live_ingest:
+    vs = LatestFrameReader(stream_url).start()
+    logging.info("Live ingest enabled: stale frames are dropped so detections follow the drone.")
+else:
+    vs = VideoStream(stream_url).start()
+    time.sleep(2.0)  # Warm-up time
 
 current_time = datetime.now().strftime("%mm%d_%H%M")
 processed_output_filename = f"{drone}_{model_name}_{current_time}.mp4"
 unprocessed_output_filename = f"{drone}_{model_name}_{current_time}.mp4"
 proc_file_path = os.path.join(proc_out_dir, processed_output_filename)
 unproc_file_path = os.path.join(unproc_out_dir, unprocessed_output_filename)
+comparison_file_path = os.path.join(comparison_out_dir, f"{drone}_{model_name}_{current_time}.mp4")
+
+recorder = None
+if unproc_mode == 'passthrough':
+    if PassthroughRecorder.available():
+        # Opens its own connection to the stream and copies the bitstream untouched
+        recorder = PassthroughRecorder(stream_url, unproc_file_path).start()
+    else:
+        logging.error("ffmpeg not found, falling back to re-encoding the unprocessed footage.")
+        unproc_mode = 'encode'
 
 fourcc = cv2.VideoWriter_fourcc(*'avc1')
-proc_out, unproc_out = None, None
-frame_count, detection_interval, frames_processed = 0, 1, 0
+proc_out, unproc_out, comparison_out = None, None, None
+# Both panes are written into one reusable buffer instead of resize + hstack allocations per frame
+comparison = ComparisonCanvas(comparison_width)
+frame_count, detection_interval, frames_processed = 0, int(os.getenv('DETECTION_INTERVAL', '1')), 0
+# Tunes detection_interval (and optionally the inference size) at runtime when ADAPTIVE_INTERVAL=1
+controller = controller_from_env(default_fps)
+
+# Reuses the previous detections on static frames when MOTION_GATE=1
+motion_gate = motion_gate_from_env()
 
 prev_time = time.time()
+last_report = prev_time
+report_interval = 5.0  # Seconds between drop/lag log lines
 
 
 try:
     while True:
-        frame = vs.read()
+        with metrics.timer("decode"):
+            if live_ingest:
+                frame, captured_at = vs.read_with_timestamp()
+            else:
+                frame = vs.read()
         if frame is None:
             logging.error("Empty frame received. End of stream?")
             break
 
-        update_detection = frame_count % detection_interval == 0
+        frame_start = time.perf_counter()
+        if controller:
+            update_detection = controller.should_detect()
+        else:
+            update_detection = frame_count % detection_interval == 0
+        if update_detection and motion_gate:
+            update_detection = motion_gate.should_infer(frame)
         processed_frame = detect_objects(frame, update_detection)
 
         # Calculate FPS
@@ -92,26 +168,45 @@ try:
         # Display FPS on the processed frame for reference
         cv2.putText(processed_frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         
-        if proc_out is None or unproc_out is None:
-            height, width = frame.shape[:2]
-            proc_out = cv2.VideoWriter(proc_file_path, fourcc, default_fps, (width, height))
-            unproc_out = cv2.VideoWriter(unproc_file_path, fourcc, default_fps, (width, height))
-
-        # Save frames to videos
-        unproc_out.write(frame)
-        proc_out.write(processed_frame)
+        with metrics.timer("encode"):
+            if proc_out is None:
+                height, width = frame.shape[:2]
+                proc_out = writer_from_env(proc_file_path, fourcc, default_fps, (width, height))
+                if unproc_mode == 'encode':
+                    unproc_out = writer_from_env(unproc_file_path, fourcc, default_fps, (width, height))
+
+            # Save frames to videos
+            if unproc_out:
+                unproc_out.write(frame)
+            proc_out.write(processed_frame)
+
+        with metrics.timer("display"):
+            # Unprocessed and processed frames side by side, processed resized only if needed
+            combined_frame = comparison.compose(frame, processed_frame)
+
+            # Display the combined frame; the canvas is reused, so the preview takes a copy
+            display.show('Stream Comparison', combined_frame, copy=True)
+            key = display.poll_key()
+        if save_comparison:
+            with metrics.timer("encode"):
+                if comparison_out is None:
+                    comparison_size = combined_frame.shape[1::-1]
+                    comparison_out = writer_from_env(comparison_file_path, fourcc, default_fps, comparison_size)
+                # Segmented writers queue frames by reference, the canvas is overwritten next frame
+                segmented = isinstance(comparison_out, SegmentedWriter)
+                comparison_out.write(combined_frame.copy() if segmented else combined_frame)
+        metrics.maybe_export()
+        if live_ingest:
+            vs.record_display(captured_at)
+            if time.time() - last_report >= report_interval:
+                logging.info(f"Live ingest: {vs.format_report()}")
+                last_report = time.time()
+
+        if controller:
+            controller.record_frame(time.perf_counter() - frame_start, last_inference_time)
 
-        # Resize processed frame to match the unprocessed frame size if necessary
-        processed_frame_resized = cv2.resize(processed_frame, (width, height))
-        
-        # Concatenate frames horizontally
-        combined_frame = np.hstack((frame, processed_frame_resized))
-
-        # Display the combined frame
-        cv2.imshow('Stream Comparison', combined_frame)
-        
         frame_count += 1
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if key == ord('q'):
             break
 except KeyboardInterrupt:
     logging.info("Interrupted by user.")
@@ -121,7 +216,19 @@ finally:
         proc_out.release()
     if unproc_out:
         unproc_out.release()
-    cv2.destroyAllWindows()
+    if comparison_out:
+        comparison_out.release()
+        logging.info(f"Comparison video saved to: {os.path.abspath(comparison_file_path)}")
+    if recorder:
+        recorder.stop()
+    display.close()
+    if metrics.summary():
+        logging.info(f"Stage latency: {metrics.format_summary()}")
+        metrics.export()
+    if motion_gate:
+        logging.info(f"Motion gate: {motion_gate.format_report()}")
+    if cascade:
+        logging.info(f"Cascade: {cascade.format_report()}")
 
     # Log the outcome of the video processing
     if frame_count > 0:
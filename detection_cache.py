@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+# Columns of a detections array: x1, y1, x2, y2, confidence, class
+EMPTY_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+# Corner order of a box outline, as (x, y) column pairs into a detections row
+_CORNERS = np.array([[0, 1], [2, 1], [2, 3], [0, 3]])
+
+
+def detections_from_results(results, index=0):
+    """
+    Convert the boxes of one image of a yolov5 Detections object to a compact array.
+
+    Parameters:
+    - results: Detections returned by a torch.hub yolov5 model.
+    - index: Image index inside the batch.
+
+    Returns:
+    - float32 array of shape (N, 6): x1, y1, x2, y2, confidence, class.
+    """
+    if results is None:
+        return EMPTY_DETECTIONS
+    boxes = results.xyxy[index]
+    if hasattr(boxes, "cpu"):
+        boxes = boxes.cpu().numpy()
+    return np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of two (N, 4+) and (M, 4+) box arrays, as an (N, M) matrix."""
+    a, b = boxes_a[:, None, :4], boxes_b[None, :, :4]
+    width = (np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])).clip(0)
+    height = (np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])).clip(0)
+    inter = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def class_colors(num_classes, seed=0):
+    """One stable BGR colour per class id."""
+    rng = np.random.default_rng(seed)
+    return [tuple(int(c) for c in color) for color in rng.integers(64, 256, size=(max(num_classes, 1), 3))]
+
+
+class DetectionCache:
+    """
+    Keeps the last keyframe's detections and draws them onto any later frame.
+
+    Drawing works on the current BGR frame directly: all box outlines go through a
+    single cv2.polylines call per class, so non-keyframes cost a copy and a few
+    labels instead of a re-render of the old keyframe and two colour conversions.
+
+    Parameters:
+    - names: Class names of the model (list or dict, as exposed by model.names).
+    - thickness: Line thickness of the boxes.
+    - draw_labels: Write "name conf" above each box.
+    """
+
+    def __init__(self, names=None, thickness=2, draw_labels=True):
+        self.names = names or {}
+        self.thickness = thickness
+        self.draw_labels = draw_labels
+        self.colors = class_colors(len(self.names))
+        self.detections = EMPTY_DETECTIONS
+
+    def update(self, detections):
+        self.detections = detections if detections is not None else EMPTY_DETECTIONS
+
+    def update_from_results(self, results, index=0):
+        self.update(detections_from_results(results, index))
+        return self.detections
+
+    def label(self, cls):
+        try:
+            return self.names[int(cls)]
+        except (IndexError, KeyError):
+            return str(int(cls))
+
+    def draw(self, frame, detections=None, copy=True):
+        """
+        Draw cached (or the given) detections onto a BGR frame.
+
+        Parameters:
+        - frame: Current BGR frame.
+        - detections: Array to draw instead of the cached one, e.g. a pipeline item's snapshot.
+        - copy: Draw on a copy so the raw frame can still be written unprocessed.
+
+        Returns:
+        - The annotated frame.
+        """
+        detections = self.detections if detections is None else detections
+        out = frame.copy() if copy else frame
+        if not len(detections):
+            return out
+
+        corners = detections[:, _CORNERS].round().astype(np.int32)
+        classes = detections[:, 5].astype(np.int32)
+        for cls in np.unique(classes):
+            color = self.colors[cls % len(self.colors)]
+            cv2.polylines(out, list(corners[classes == cls]), True, color, self.thickness)
+
+        if self.draw_labels:
+            for (x1, y1), conf, cls in zip(corners[:, 0], detections[:, 4], classes):
+                cv2.putText(out, f"{self.label(cls)} {conf:.2f}", (int(x1), max(int(y1) - 5, 10)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, self.colors[cls % len(self.colors)], 2)
+        return out
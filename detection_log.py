@@ -0,0 +1,145 @@
+import logging
+import os
+import zipfile
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional; chunked NPZ needs nothing but numpy
+    pa = pq = None
+
+# Columns of a detection log and their on-disk types: one row per box
+DETECTION_COLUMNS = {
+    "frame": np.int32,
+    "timestamp": np.float64,
+    "class": np.int16,
+    "confidence": np.float32,
+    "x1": np.float32,
+    "y1": np.float32,
+    "x2": np.float32,
+    "y2": np.float32,
+}
+
+
+class DetectionLog:
+    """
+    Columnar detections file written in buffered, append-only chunks.
+
+    Rows are collected in memory and flushed every flush_rows boxes, so memory
+    stays flat on long videos and a crash only loses the last buffer.
+
+    - .parquet: one row group per flush through pyarrow's ParquetWriter.
+    - .npz: every flush appends one array per column (`frame_00000`, ...) to the
+      zip archive; load_detections() concatenates them back.
+
+    Parameters:
+    - path: Output file; the extension picks the format.
+    - flush_rows: Boxes buffered before they are written.
+    """
+
+    def __init__(self, path, flush_rows=10000):
+        if path.endswith(".parquet") and pq is None:
+            logging.warning("pyarrow is not installed, writing the detections as .npz instead of Parquet.")
+            path = os.path.splitext(path)[0] + ".npz"
+        self.path = path
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.buffered = 0
+        self.chunks = 0
+        self.rows = 0
+        self.parquet = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    def append(self, frame_index, timestamp, detections):
+        """Add the (N, 6) detections of one frame."""
+        if not len(detections):
+            return
+        count = len(detections)
+        self.extend({
+            "frame": np.full(count, frame_index),
+            "timestamp": np.full(count, timestamp),
+            "class": detections[:, 5],
+            "confidence": detections[:, 4],
+            "x1": detections[:, 0],
+            "y1": detections[:, 1],
+            "x2": detections[:, 2],
+            "y2": detections[:, 3],
+        })
+
+    def extend(self, columns):
+        """Add whole columns at once, e.g. the contents of another log."""
+        count = len(columns["frame"])
+        if not count:
+            return
+        self.buffer.append(columns)
+        self.buffered += count
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        table = {
+            name: np.concatenate([chunk[name] for chunk in self.buffer]).astype(dtype)
+            for name, dtype in DETECTION_COLUMNS.items()
+        }
+        if self.path.endswith(".parquet"):
+            batch = pa.table(table)
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, batch.schema, compression="zstd")
+            self.parquet.write_table(batch)
+        else:
+            with zipfile.ZipFile(self.path, "a") as archive:
+                for name, values in table.items():
+                    with archive.open(f"{name}_{self.chunks:05d}.npy", "w") as f:
+                        np.lib.format.write_array(f, values)
+        self.chunks += 1
+        self.rows += self.buffered
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.parquet is not None:
+            self.parquet.close()
+            self.parquet = None
+        elif not self.chunks:
+            # Leave a readable file behind even when nothing was detected
+            np.savez(self.path, **{f"{name}_00000": np.zeros(0, dtype) for name, dtype in DETECTION_COLUMNS.items()})
+
+
+def load_detections(path):
+    """
+    Read a detection log back.
+
+    Returns:
+    - dict of column name -> numpy array.
+    """
+    if path.endswith(".parquet"):
+        table = pq.read_table(path)
+        return {name: table.column(name).to_numpy() for name in DETECTION_COLUMNS}
+    with np.load(path) as archive:
+        chunks = sorted(archive.files)
+        return {
+            name: np.concatenate([archive[key] for key in chunks if key.rsplit("_", 1)[0] == name]).astype(dtype)
+            for name, dtype in DETECTION_COLUMNS.items()
+        }
+
+
+def detections_only_from_env():
+    """True when DETECTIONS_ONLY=1: skip rendering and encoding, write only the detection log."""
+    return os.getenv("DETECTIONS_ONLY", "0") == "1"
+
+
+def detection_log_path(base_path):
+    """base_path with the extension of DETECTIONS_FORMAT (npz, the default, or parquet)."""
+    extension = ".npz"
+    if os.getenv("DETECTIONS_FORMAT", "npz") == "parquet":
+        if pq is None:
+            logging.warning("DETECTIONS_FORMAT=parquet needs pyarrow, writing .npz instead.")
+        else:
+            extension = ".parquet"
+    return base_path + "_detections" + extension
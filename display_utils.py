@@ -0,0 +1,238 @@
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+_BOUNDARY = "frame"
+_INDEX_PAGE = b"""<html><head><title>Smart Drone Vision preview</title></head>
+<body style="margin:0;background:#111"><img src="/stream" style="width:100%"></body></html>"""
+
+
+class PreviewServer:
+    """
+    Local HTTP MJPEG endpoint serving downscaled, rate-limited previews.
+
+    publish() only swaps a reference to the newest frame, so it never blocks the
+    caller. A separate encoder thread resizes and JPEG-encodes at most max_fps
+    frames per second and every connected browser gets the latest JPEG.
+
+    Parameters:
+    - host, port: Address to listen on (0.0.0.0 makes it reachable from the LAN).
+    - max_width: Frames wider than this are downscaled before encoding.
+    - max_fps: Upper bound on encoded preview frames per second.
+    - quality: JPEG quality (0-100).
+    """
+
+    def __init__(self, host="0.0.0.0", port=8080, max_width=640, max_fps=5.0, quality=70):
+        self.host = host
+        self.port = port
+        self.max_width = max_width
+        self.min_period = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.quality = quality
+
+        self.pending = None
+        self.pending_lock = threading.Lock()
+        self.frame_ready = threading.Event()
+        self.jpeg = None
+        self.jpeg_seq = 0
+        self.jpeg_ready = threading.Condition()
+        self.stopped = threading.Event()
+        self.last_publish = 0.0
+        self.httpd = None
+        self.threads = []
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html")
+                    self.end_headers()
+                    self.wfile.write(_INDEX_PAGE)
+                elif self.path == "/stream":
+                    self.send_response(200)
+                    self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={_BOUNDARY}")
+                    self.end_headers()
+                    server._stream_to(self.wfile)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.threads = [
+            threading.Thread(target=self.httpd.serve_forever, name="preview-http", daemon=True),
+            threading.Thread(target=self._encode_loop, name="preview-encoder", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"MJPEG preview available at http://{self.host}:{self.port}/")
+        return self
+
+    def publish(self, frame, copy=False):
+        """
+        Offer a BGR frame for the preview. Cheap and non-blocking; extra frames are skipped.
+        Pass copy=True for buffers the caller overwrites later (only accepted frames are copied).
+        """
+        now = time.time()
+        if now - self.last_publish < self.min_period:
+            return
+        self.last_publish = now
+        with self.pending_lock:
+            self.pending = frame.copy() if copy else frame
+        self.frame_ready.set()
+
+    def _encode_loop(self):
+        while not self.stopped.is_set():
+            if not self.frame_ready.wait(timeout=0.5):
+                continue
+            self.frame_ready.clear()
+            with self.pending_lock:
+                frame, self.pending = self.pending, None
+            if frame is None:
+                continue
+            height, width = frame.shape[:2]
+            if width > self.max_width:
+                frame = cv2.resize(frame, (self.max_width, int(height * self.max_width / width)),
+                                   interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                continue
+            with self.jpeg_ready:
+                self.jpeg = encoded.tobytes()
+                self.jpeg_seq += 1
+                self.jpeg_ready.notify_all()
+
+    def _stream_to(self, wfile):
+        seen = 0
+        try:
+            while not self.stopped.is_set():
+                with self.jpeg_ready:
+                    self.jpeg_ready.wait_for(lambda: self.jpeg_seq != seen or self.stopped.is_set(), timeout=1.0)
+                    if self.jpeg_seq == seen:
+                        continue
+                    jpeg, seen = self.jpeg, self.jpeg_seq
+                wfile.write(
+                    f"--{_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode()
+                )
+                wfile.write(jpeg)
+                wfile.write(b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def stop(self):
+        self.stopped.set()
+        self.frame_ready.set()
+        with self.jpeg_ready:
+            self.jpeg_ready.notify_all()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+class FrameDisplay:
+    """
+    Replaces the cv2.imshow / cv2.waitKey calls of the scripts.
+
+    In headless mode no GUI call is made at all; frames only go to the optional
+    MJPEG preview.
+    """
+
+    def __init__(self, headless=False, preview=None):
+        self.headless = headless
+        self.preview = preview
+
+    def publish(self, frame, copy=False):
+        if self.preview is not None:
+            self.preview.publish(frame, copy)
+
+    def show(self, window_name, frame, copy=False):
+        self.publish(frame, copy)
+        if not self.headless:
+            cv2.imshow(window_name, frame)
+
+    def poll_key(self):
+        """Key pressed in the GUI window, or -1 when headless."""
+        if self.headless:
+            return -1
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        if self.preview is not None:
+            self.preview.stop()
+        if not self.headless:
+            cv2.destroyAllWindows()
+
+
+class ComparisonCanvas:
+    """
+    Side-by-side view of two frames built in one reusable buffer.
+
+    Both panes are written straight into a canvas allocated once per frame size.
+    The right pane is only resized when its size differs from the left one. An
+    optional display_width downscales the whole canvas into a second reusable
+    buffer, which is cheaper to show, preview or save than a double-width 4K frame.
+
+    Parameters:
+    - display_width: Width of the returned canvas; None keeps full resolution.
+    """
+
+    def __init__(self, display_width=None):
+        self.display_width = display_width
+        self.canvas = None
+        self.display = None
+
+    def _buffer(self, buffer, shape):
+        if buffer is None or buffer.shape != shape:
+            return np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def compose(self, left, right):
+        """
+        Returns:
+        - The canvas with `left` in the left pane and `right` (scaled to the size of
+          `left`) in the right pane. The buffer is reused, so copy it if you keep it.
+        """
+        height, width = left.shape[:2]
+        self.canvas = self._buffer(self.canvas, (height, width * 2, 3))
+        self.canvas[:, :width] = left
+        if right.shape[:2] == (height, width):
+            self.canvas[:, width:] = right
+        else:
+            cv2.resize(right, (width, height), dst=self.canvas[:, width:])
+
+        if not self.display_width or self.display_width >= width * 2:
+            return self.canvas
+        display_height = int(height * self.display_width / (width * 2))
+        self.display = self._buffer(self.display, (display_height, self.display_width, 3))
+        cv2.resize(self.canvas, (self.display_width, display_height), dst=self.display, interpolation=cv2.INTER_AREA)
+        return self.display
+
+
+def display_from_env():
+    """Build a FrameDisplay from HEADLESS and the PREVIEW_* settings."""
+    headless = os.getenv("HEADLESS", "0") == "1"
+    preview = None
+    port = int(os.getenv("PREVIEW_PORT", "0"))
+    if port:
+        try:
+            preview = PreviewServer(
+                host=os.getenv("PREVIEW_HOST", "0.0.0.0"),
+                port=port,
+                max_width=int(os.getenv("PREVIEW_MAX_WIDTH", "640")),
+                max_fps=float(os.getenv("PREVIEW_FPS", "5")),
+            ).start()
+        except OSError as e:
+            logging.error(f"Failed to start MJPEG preview on port {port}: {e}")
+            preview = None
+    if headless:
+        logging.info("Headless mode: no GUI windows will be opened.")
+    return FrameDisplay(headless=headless, preview=preview)
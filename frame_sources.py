@@ -0,0 +1,339 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class LatestFrameReader:
+    """
+    Live ingest that always hands out the newest frame of a stream.
+
+    A background thread drains the capture as fast as the source delivers, keeping
+    only the most recent frame. Frames that are overwritten before anyone reads them
+    are counted as drops, so a slow detector never falls behind the drone.
+
+    Drop-in replacement for imutils' VideoStream: start(), read(), stop().
+
+    Parameters:
+    - src: Stream URL or video file.
+    - read_timeout: Seconds read() waits for a new frame before giving up.
+    - pace: Deliver frames no faster than the source FPS. Lets a recorded file
+      stand in for a live drone, otherwise it would be drained at decode speed.
+    """
+
+    def __init__(self, src, read_timeout=5.0, pace=False):
+        self.src = src
+        self.read_timeout = read_timeout
+        self.pace = pace
+        self.cap = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.new_frame = threading.Condition()
+
+        self.frame = None
+        self.captured_at = None
+        self.seq = 0  # Sequence number of the frame currently held
+        self.last_read_seq = 0
+        self.ended = False
+
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_count = 0
+        self._last_report = {"time": time.time(), "dropped": 0, "delivered": 0}
+
+    def start(self):
+        self.cap = cv2.VideoCapture(self.src)
+        if not self.cap.isOpened():
+            logging.error(f"Failed to open video stream: {self.src}")
+        self.thread = threading.Thread(target=self._update, name="latest-frame-reader", daemon=True)
+        self.thread.start()
+        return self
+
+    def _update(self):
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.pace else 0
+        period = 1.0 / fps if fps and fps > 0 else 0.0
+        next_due = time.time()
+        while not self.stopped.is_set():
+            if period:
+                next_due += period
+                time.sleep(max(next_due - time.time(), 0.0))
+            ret, frame = self.cap.read()
+            now = time.time()
+            with self.new_frame:
+                if not ret:
+                    self.ended = True
+                    self.new_frame.notify_all()
+                    break
+                self.frame = frame
+                self.captured_at = now
+                self.seq += 1
+                self.captured += 1
+                self.new_frame.notify_all()
+
+    @property
+    def finished(self):
+        """True once the source ended and its last frame has been handed out."""
+        return (self.ended or self.stopped.is_set()) and self.seq == self.last_read_seq
+
+    def read_with_timestamp(self, timeout=None):
+        """
+        Block until a frame newer than the last one handed out is available.
+
+        Parameters:
+        - timeout: Seconds to wait, read_timeout when None. 0 polls without blocking.
+
+        Returns:
+        - (frame, captured_at), or (None, None) once the stream has ended or timed out.
+        """
+        deadline = time.time() + (self.read_timeout if timeout is None else timeout)
+        with self.new_frame:
+            while self.seq == self.last_read_seq and not self.ended and not self.stopped.is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None, None
+                self.new_frame.wait(timeout=remaining)
+            if self.seq == self.last_read_seq:
+                return None, None
+            # Every frame captured since the previous read was never seen by the detector
+            self.dropped += self.seq - self.last_read_seq - 1
+            self.last_read_seq = self.seq
+            self.delivered += 1
+            return self.frame, self.captured_at
+
+    def read(self):
+        frame, _ = self.read_with_timestamp()
+        return frame
+
+    def record_display(self, captured_at, displayed_at=None):
+        """Track the capture-to-display lag of a frame that reached the operator."""
+        if captured_at is None:
+            return
+        lag = (displayed_at or time.time()) - captured_at
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.lag_count += 1
+
+    def report(self):
+        """
+        Drop and lag statistics since the previous call.
+
+        Returns:
+        - dict with drops_per_sec, delivered_per_sec, mean and max capture-to-display lag (s)
+          and the cumulative drop count.
+        """
+        now = time.time()
+        elapsed = max(now - self._last_report["time"], 1e-6)
+        stats = {
+            "drops_per_sec": (self.dropped - self._last_report["dropped"]) / elapsed,
+            "delivered_per_sec": (self.delivered - self._last_report["delivered"]) / elapsed,
+            "lag_mean": self.lag_total / self.lag_count if self.lag_count else 0.0,
+            "lag_max": self.lag_max,
+            "dropped_total": self.dropped,
+        }
+        self._last_report = {"time": now, "dropped": self.dropped, "delivered": self.delivered}
+        self.lag_total, self.lag_max, self.lag_count = 0.0, 0.0, 0
+        return stats
+
+    def format_report(self):
+        stats = self.report()
+        return (
+            f"drops/s={stats['drops_per_sec']:.1f} delivered/s={stats['delivered_per_sec']:.1f} "
+            f"lag mean={stats['lag_mean'] * 1000:.0f}ms max={stats['lag_max'] * 1000:.0f}ms "
+            f"dropped total={stats['dropped_total']}"
+        )
+
+    def stop(self):
+        self.stopped.set()
+        with self.new_frame:
+            self.new_frame.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+        if self.cap is not None:
+            self.cap.release()
+
+
+def read_batch(cap, count):
+    """
+    Decode up to `count` frames ahead from a cv2.VideoCapture.
+
+    Returns:
+    - list of frames in decode order; shorter than `count` (or empty) at the end of the video.
+    """
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    return frames
+
+
+def load_frames(video_path, count):
+    """
+    RGB frames from the start of a sample video for the benchmarks and the autotuner,
+    or `count` seeded random 1280x720 frames when there is no readable video.
+    """
+    cap = cv2.VideoCapture(video_path) if video_path else None
+    if cap is not None and cap.isOpened():
+        frames = read_batch(cap, count)
+        cap.release()
+        if frames:
+            logging.info(f"Using {len(frames)} frames of {video_path}")
+            return [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    if video_path:
+        logging.warning(f"Could not read {video_path}, using {count} random 1280x720 frames")
+    else:
+        logging.info(f"No sample video, using {count} random 1280x720 frames")
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, size=(720, 1280, 3), dtype=np.uint8) for _ in range(count)]
+
+
+class FrameSampler:
+    """
+    Reads every `step`-th frame of a recorded video for sparse analysis.
+
+    Frames in between are skipped with cap.grab(), which demuxes and decodes but
+    never converts or copies the picture. Gaps of at least seek_gap frames are
+    skipped by seeking instead, which only pays off when the gap spans a keyframe
+    interval or more. Every frame comes back with its index in the source, so
+    timestamps stay those of the original footage.
+
+    Parameters:
+    - cap: Opened cv2.VideoCapture.
+    - source_fps: Frame rate of the video.
+    - sample_fps: Frames per second to analyse; 0 reads every frame.
+    - seek_gap: Skip gaps of at least this many frames by seeking, 0 never seeks.
+    """
+
+    def __init__(self, cap, source_fps, sample_fps=0.0, seek_gap=0):
+        self.cap = cap
+        self.source_fps = source_fps
+        self.step = max(1, round(source_fps / sample_fps)) if sample_fps and source_fps else 1
+        self.seek_gap = seek_gap
+        self.position = 0  # Index of the frame the capture returns next
+        self.next_index = 0
+        self.skipped = 0
+
+    @property
+    def output_fps(self):
+        """Frame rate of the sampled frames, for writing a real-time video of them."""
+        return self.source_fps / self.step
+
+    def read(self):
+        """
+        Returns:
+        - (index, frame) of the next sampled frame, or (None, None) at the end of the video.
+        """
+        gap = self.next_index - self.position
+        if self.seek_gap and gap >= self.seek_gap:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.next_index)
+            self.position = self.next_index
+        else:
+            while self.position < self.next_index:
+                if not self.cap.grab():
+                    return None, None
+                self.position += 1
+        ret, frame = self.cap.read()
+        if not ret:
+            return None, None
+        index = self.position
+        self.skipped += gap
+        self.position += 1
+        self.next_index = index + self.step
+        return index, frame
+
+    def read_batch(self, count):
+        """Up to `count` sampled (index, frame) pairs; empty at the end of the video."""
+        batch = []
+        while len(batch) < count:
+            index, frame = self.read()
+            if frame is None:
+                break
+            batch.append((index, frame))
+        return batch
+
+
+class PrefetchReader:
+    """
+    Decodes ahead in a background thread, so inference never waits on the decoder.
+
+    Frames go into a bounded queue; when it is full the decoder thread waits, which
+    keeps memory bounded no matter how slow the model is. depth() shows how full
+    the queue is: near empty means decoding is the bottleneck, near full means
+    inference or writing is.
+
+    Parameters:
+    - read: Callable returning (index, frame), and (None, None) at the end, e.g. FrameSampler.read.
+    - queue_size: Frames decoded ahead.
+    """
+
+    def __init__(self, read, queue_size=16):
+        self.read_func = read
+        self.frames = queue.Queue(maxsize=max(1, queue_size))
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="prefetch-decoder", daemon=True)
+        self.thread.start()
+        return self
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            while not self.stopped.is_set():
+                item = self.read_func()
+                if item[1] is None or not self._put(item):
+                    break
+        except Exception as e:
+            logging.error(f"Decoder thread stopped: {e}")
+        self._put((None, None))
+
+    def read(self):
+        """Same contract as FrameSampler.read()."""
+        if self.finished:
+            return None, None
+        item = self.frames.get()
+        if item[1] is None:
+            self.finished = True
+        return item
+
+    def read_batch(self, count):
+        batch = []
+        while len(batch) < count:
+            index, frame = self.read()
+            if frame is None:
+                break
+            batch.append((index, frame))
+        return batch
+
+    def depth(self):
+        return self.frames.qsize()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+
+
+def prefetch_from_env(read):
+    """PrefetchReader of PREFETCH_FRAMES frames (default 16) around `read`, or None unless ASYNC_IO=1."""
+    if os.getenv("ASYNC_IO", "0") != "1":
+        return None
+    return PrefetchReader(read, int(os.getenv("PREFETCH_FRAMES", "16"))).start()
@@ -2,8 +2,17 @@ import os
 import sys
 import time
 import cv2
-import torch
 from pathlib import Path
+from dotenv import load_dotenv
+
+from detection_cache import DetectionCache
+from model_registry import load_model
+from tiled_inference import tiled_detector_from_env
+from tuning_profile import apply_profile
+
+# TILED_INFERENCE and the TILE_* settings can come from the .env file
+load_dotenv()
+apply_profile()
 
 def is_valid_image(file_path):
     """
@@ -37,11 +46,16 @@ output_dir.mkdir(parents=True, exist_ok=True)
 weights_path = r"C:\Users\David\Projects\smart-drone-vision\yolov5\runs\train\exp5\weights\best.pt"
 
 # Load the fine-tuned YOLOv5 model
-model = torch.hub.load('ultralytics/yolov5', 'custom', path=weights_path, force_reload=True)
+model = load_model(f"custom:{weights_path}")  # Pre-built copy from the local model registry
 
 # Optionally adjust model parameters
 model.conf = 0.45  # confidence threshold (0-1)
 model.iou = 0.45   # NMS IoU threshold (0-1)
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+
+# Overlapping tiles at native resolution when TILED_INFERENCE=1, for small trees in large images
+tiled_detector = tiled_detector_from_env(model)
+detection_cache = DetectionCache(model.names)
 
 # Define the custom progress bar function
 def custom_progress_bar(current, total, bar_length=50):
@@ -66,12 +80,17 @@ for i, img_path in enumerate(image_paths):
     # Read the image
     img = cv2.imread(str(img_path))
     
-    # Inference
-    results = model(img, size=640)
-    
-    # Render results on the image
-    img_detected = results.render()[0]
-    img_detected = cv2.cvtColor(img_detected, cv2.COLOR_BGR2RGB)
+    if tiled_detector:
+        # Tiles are cut from the RGB image and their boxes drawn back onto the BGR one
+        detection_cache.update(tiled_detector(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+        img_detected = detection_cache.draw(img, copy=False)
+    else:
+        # Inference
+        results = model(img, size=inference_size)
+
+        # Render results on the image
+        img_detected = results.render()[0]
+        img_detected = cv2.cvtColor(img_detected, cv2.COLOR_BGR2RGB)
     
     # Save the image
     output_path = output_dir / img_path.name
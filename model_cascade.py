@@ -0,0 +1,183 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from detection_cache import EMPTY_DETECTIONS, box_iou, detections_from_results
+from model_registry import load_model
+from tiled_inference import nms
+
+
+def _class_names(model):
+    names = model.names
+    return names if isinstance(names, dict) else dict(enumerate(names))
+
+
+class ModelCascade:
+    """
+    Two-tier detector: a light model on every frame, the heavy model on demand.
+
+    The light model runs with a low confidence floor so that uncertain objects are
+    still visible to it. The heavy model is only called when the light model is
+    unsure of something (a box between light_conf and escalate_below) or when a
+    new object appears (a light box with no match in the previous frame), plus
+    every max_light_frames frames as a safety net.
+
+    In "frame" mode an escalation reruns the heavy model on the whole frame and its
+    detections are returned. In "crop" mode only the regions around the uncertain
+    and new boxes go through the heavy model in one batch; confident light boxes
+    are kept as they are. Crop mode needs both models to share class ids, and falls
+    back to a full frame when there are more than max_crops regions.
+
+    Parameters:
+    - light_model, heavy_model: torch.hub yolov5 models (AutoShape), both kept resident.
+    - mode: "frame" or "crop".
+    - light_conf: Confidence floor of the light model.
+    - escalate_below: Light boxes under this confidence trigger the heavy model.
+    - match_iou: IoU above which a light box counts as already seen in the previous frame.
+    - max_light_frames: Force an escalation after this many light-only frames, 0 never forces.
+    - crop_size: Minimum crop edge and inference size of the crops.
+    - max_crops: More regions than this escalate the whole frame instead.
+    """
+
+    def __init__(self, light_model, heavy_model, mode="frame", light_conf=0.25, escalate_below=0.5,
+                 match_iou=0.3, max_light_frames=0, crop_size=320, max_crops=8):
+        self.light_model = light_model
+        self.heavy_model = heavy_model
+        self.mode = mode
+        self.light_conf = light_conf
+        self.escalate_below = escalate_below
+        self.match_iou = match_iou
+        self.max_light_frames = max_light_frames
+        self.crop_size = crop_size
+        self.max_crops = max_crops
+        self.light_model.conf = light_conf
+
+        if mode == "crop" and _class_names(light_model) != _class_names(heavy_model):
+            logging.warning("Cascade: the light and heavy models have different classes, using frame mode.")
+            self.mode = "frame"
+
+        self.previous_light = EMPTY_DETECTIONS
+        self.last_output = EMPTY_DETECTIONS
+        self.light_frames_in_row = 0
+        self.frames = 0
+        self.escalated_frames = 0
+        self.escalated_crops = 0
+        self.light_seconds = 0.0
+        self.heavy_seconds = 0.0
+        self.heavy_calls = 0
+
+    def _regions_to_check(self, light):
+        """Indices of the light boxes that are either uncertain or new."""
+        uncertain = light[:, 4] < self.escalate_below
+        new = np.ones(len(light), dtype=bool)
+        if len(light) and len(self.previous_light):
+            same_class = light[:, 5:6] == self.previous_light[None, :, 5]
+            new = ~((box_iou(light, self.previous_light) > self.match_iou) & same_class).any(axis=1)
+        return np.flatnonzero(uncertain | new)
+
+    def _crop_box(self, box, width, height):
+        """Square-ish region around a box with some context, at least crop_size on each side."""
+        x1, y1, x2, y2 = box[:4]
+        side_x = max(self.crop_size, (x2 - x1) * 2)
+        side_y = max(self.crop_size, (y2 - y1) * 2)
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        x0 = int(np.clip(cx - side_x / 2, 0, max(width - side_x, 0)))
+        y0 = int(np.clip(cy - side_y / 2, 0, max(height - side_y, 0)))
+        return x0, y0, min(int(x0 + side_x), width), min(int(y0 + side_y), height)
+
+    def _run_heavy(self, images, size):
+        start = time.perf_counter()
+        results = self.heavy_model(images, size=size)
+        self.heavy_seconds += time.perf_counter() - start
+        self.heavy_calls += 1
+        return results
+
+    def __call__(self, frame_rgb, size=640):
+        """
+        Returns:
+        - (N, 6) float32 detections in frame coordinates.
+        """
+        self.frames += 1
+        start = time.perf_counter()
+        light = detections_from_results(self.light_model(frame_rgb, size=size))
+        self.light_seconds += time.perf_counter() - start
+
+        regions = self._regions_to_check(light)
+        forced = self.max_light_frames and self.light_frames_in_row >= self.max_light_frames
+        self.previous_light = light
+
+        if not len(regions) and not forced:
+            # Every light box is confident and already known: the light answer stands
+            self.light_frames_in_row += 1
+            self.last_output = light
+            return self.last_output
+
+        self.escalated_frames += 1
+        self.light_frames_in_row = 0
+        if self.mode != "crop" or forced or len(regions) > self.max_crops:
+            self.last_output = detections_from_results(self._run_heavy(frame_rgb, size))
+            return self.last_output
+
+        height, width = frame_rgb.shape[:2]
+        crops = [self._crop_box(light[i], width, height) for i in regions]
+        results = self._run_heavy([frame_rgb[y0:y1, x0:x1] for x0, y0, x1, y1 in crops], self.crop_size)
+        self.escalated_crops += len(crops)
+
+        found = [np.delete(light, regions, axis=0)]
+        for i, (x0, y0, _, _) in enumerate(crops):
+            detections = detections_from_results(results, i).copy()
+            detections[:, [0, 2]] += x0
+            detections[:, [1, 3]] += y0
+            found.append(detections)
+        self.last_output = nms(np.concatenate(found), 0.45)
+        return self.last_output
+
+    def format_report(self):
+        if not self.frames:
+            return "no frames"
+        ratio = self.escalated_frames / self.frames
+        light_ms = self.light_seconds * 1000 / self.frames
+        heavy_ms = self.heavy_seconds * 1000 / self.heavy_calls if self.heavy_calls else 0.0
+        average_ms = (self.light_seconds + self.heavy_seconds) * 1000 / self.frames
+        report = (
+            f"escalated {self.escalated_frames} of {self.frames} frames ({ratio:.0%}), "
+            f"light {light_ms:.1f} ms/frame, heavy {heavy_ms:.1f} ms/call, {average_ms:.1f} ms/frame on average"
+        )
+        if self.mode == "crop":
+            report += f", {self.escalated_crops} crops"
+        return report
+
+
+def cascade_from_env(heavy_model):
+    """
+    ModelCascade configured from the CASCADE_* settings, or None unless CASCADE=1.
+
+    CASCADE_LIGHT_MODEL is a hub model name (default yolov5n) or a path to .pt
+    weights, which is loaded as a custom model.
+    """
+    if os.getenv("CASCADE", "0") != "1":
+        return None
+    light_name = os.getenv("CASCADE_LIGHT_MODEL", "yolov5n")
+    try:
+        light_model = load_model(light_name)
+    except Exception as e:
+        logging.error(f"Failed to load cascade light model {light_name}: {e}")
+        return None
+
+    # By default anything the heavy model would not report on its own gets a second look
+    escalate_below = float(os.getenv("CASCADE_ESCALATE_BELOW", str(getattr(heavy_model, "conf", 0.5))))
+    cascade = ModelCascade(
+        light_model,
+        heavy_model,
+        mode=os.getenv("CASCADE_MODE", "frame"),
+        light_conf=float(os.getenv("CASCADE_LIGHT_CONF", str(min(0.25, escalate_below / 2)))),
+        escalate_below=escalate_below,
+        max_light_frames=int(os.getenv("CASCADE_MAX_LIGHT_FRAMES", "0")),
+    )
+    logging.info(
+        f"Cascade enabled: {light_name} on every frame, heavy model in {cascade.mode} mode "
+        f"below {cascade.escalate_below:.2f} confidence or on new objects."
+    )
+    return cascade
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# Local registry of pre-built yolov5 models for offline loading.
+#
+#   python model_registry.py register yolov5x custom:exp5/best.pt
+#   python model_registry.py list
+#   python model_registry.py verify
+#
+# Registering builds the model through torch.hub once (this needs the network the
+# first time) and saves the whole AutoShape model with its SHA-256. Later loads read
+# that file directly: no GitHub check, no rebuild, and no network.
+HUB_REPOSITORY = "ultralytics/yolov5"
+# Defaults of MODEL_REGISTRY and of CUSTOM_WEIGHTS_ROOT, the base directory of relative
+# custom:<run>/weights paths. Both are read when used, after the scripts' load_dotenv().
+DEFAULT_REGISTRY_DIR = "model_registry"
+DEFAULT_WEIGHTS_ROOT = os.path.join("yolov5", "runs", "train")
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_name(name):
+    """
+    Resolve a model name.
+
+    - "yolov5x", "yolov5s", ...: pretrained hub models.
+    - "custom:exp5/best.pt": weights under CUSTOM_WEIGHTS_ROOT (the "weights" folder
+      may be left out); an absolute path or a bare path ending in .pt works too.
+
+    Returns:
+    - (registry key, path to custom weights or None).
+    """
+    if name.startswith("custom:") or name.endswith(".pt"):
+        path = name.split(":", 1)[1] if name.startswith("custom:") else name
+        weights_root = os.getenv("CUSTOM_WEIGHTS_ROOT", DEFAULT_WEIGHTS_ROOT)
+        candidates = [path, os.path.join(weights_root, path)]
+        head, tail = os.path.split(path)
+        candidates.append(os.path.join(weights_root, head, "weights", tail))
+        weights = next((p for p in candidates if os.path.isfile(p)), candidates[1])
+        return f"custom:{path}", os.path.abspath(weights)
+    return name, None
+
+
+def artifact_stem(key):
+    """File name stem of a registry key, shared by the model and its exported variants."""
+    stem = key.replace("custom:", "custom_").replace("/", "_").replace("\\", "_").replace(":", "")
+    return os.path.splitext(stem)[0]
+
+
+class ModelRegistry:
+    """
+    registry.json in `root` maps model names to pre-built model files.
+
+    Each entry records the file, its SHA-256, the local copy of the yolov5 code the
+    model was pickled with and, for custom models, the hash of the source weights so
+    a retrained best.pt is picked up.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv("MODEL_REGISTRY", DEFAULT_REGISTRY_DIR)
+        self.index_path = os.path.join(self.root, "registry.json")
+
+    def entries(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_entry(self, key, entry):
+        # Re-read first: another process may have registered a model meanwhile
+        entries = self.entries()
+        entries[key] = entry
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def is_current(self, name):
+        """True when the model is registered and, for custom models, its weights are unchanged."""
+        key, weights = parse_name(name)
+        entry = self.entries().get(key)
+        if entry is None or not os.path.exists(os.path.join(self.root, entry["file"])):
+            return False
+        if weights and os.path.exists(weights) and file_sha256(weights) != entry.get("source_sha256"):
+            return False
+        return True
+
+    def register(self, name):
+        """Build the model through torch.hub (network on first use) and store it pre-built."""
+        import torch
+
+        key, weights = parse_name(name)
+        os.makedirs(self.root, exist_ok=True)
+        start = time.perf_counter()
+        if weights:
+            model = torch.hub.load(HUB_REPOSITORY, "custom", path=weights)
+        else:
+            model = torch.hub.load(HUB_REPOSITORY, key, pretrained=True)
+        model = model.cpu()
+
+        file_name = artifact_stem(key) + ".model"
+        path = os.path.join(self.root, file_name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(model, tmp_path)
+        os.replace(tmp_path, path)
+
+        entry = {
+            "file": file_name,
+            "sha256": file_sha256(path),
+            "code_dir": os.path.join(torch.hub.get_dir(), "ultralytics_yolov5_master"),
+            "registered": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if weights:
+            entry["source"] = weights
+            entry["source_sha256"] = file_sha256(weights)
+        self._save_entry(key, entry)
+        logging.info(f"Registered {key} as {path} in {time.perf_counter() - start:.1f} s.")
+        return model
+
+    def verify(self, name):
+        """True when the stored file still matches its recorded hash."""
+        key, _ = parse_name(name)
+        entry = self.entries().get(key)
+        if entry is None:
+            return False
+        path = os.path.join(self.root, entry["file"])
+        return os.path.exists(path) and file_sha256(path) == entry["sha256"]
+
+    def load(self, name):
+        """Load a registered model offline. Raises KeyError or ValueError when missing or corrupt."""
+        import torch
+
+        key, _ = parse_name(name)
+        entry = self.entries().get(key)
+        if entry is None:
+            raise KeyError(f"{key} is not registered in {self.root}")
+        if not self.verify(name):
+            raise ValueError(f"{entry['file']} does not match its recorded SHA-256")
+        # The pickled model refers to the yolov5 `models` and `utils` packages
+        if entry["code_dir"] not in sys.path:
+            sys.path.insert(0, entry["code_dir"])
+        return torch.load(os.path.join(self.root, entry["file"]), map_location="cpu", weights_only=False)
+
+
+def load_model(name, registry=None, backend=None):
+    """
+    Load a yolov5 model through the registry, registering it on first use.
+
+    A model that is missing, corrupt, or whose custom weights changed is rebuilt
+    from torch.hub and registered again.
+
+    Parameters:
+    - name: Hub model name or custom:<weights>, see parse_name().
+    - backend: "torch" or "onnx"; defaults to INFERENCE_BACKEND (torch). The ONNX
+      model is exported from the registered one on first use.
+    """
+    registry = registry or ModelRegistry()
+    backend = backend or os.getenv("INFERENCE_BACKEND", "torch")
+    if backend == "onnx":
+        import onnx_backend
+
+        if onnx_backend.ort is not None:
+            return onnx_backend.load_onnx_model(name, registry)
+        logging.warning("INFERENCE_BACKEND=onnx needs onnxruntime, using torch instead.")
+    if registry.is_current(name):
+        start = time.perf_counter()
+        try:
+            model = registry.load(name)
+            logging.info(f"Loaded {name} from the model registry in {time.perf_counter() - start:.1f} s.")
+            return model
+        except (KeyError, ValueError, OSError) as e:
+            logging.warning(f"Registry copy of {name} unusable ({e}), rebuilding it.")
+    return registry.register(name)
+
+
+def ensure_registered(name, registry=None):
+    """Register `name` once up front, so parallel workers never build it at the same time."""
+    registry = registry or ModelRegistry()
+    if not registry.is_current(name):
+        registry.register(name)
+
+
+def main(argv):
+    load_dotenv()  # MODEL_REGISTRY and CUSTOM_WEIGHTS_ROOT may come from the .env file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    registry = ModelRegistry()
+    command, names = (argv[0], argv[1:]) if argv else ("list", [])
+    if command == "register":
+        for name in names:
+            registry.register(name)
+    elif command == "verify":
+        for key in names or registry.entries():
+            logging.info(f"{key}: {'ok' if registry.verify(key) else 'FAILED'}")
+    elif command == "list":
+        for key, entry in registry.entries().items():
+            logging.info(f"{key}: {entry['file']} ({entry['registered']}, sha256 {entry['sha256'][:12]})")
+    else:
+        logging.error("Usage: python model_registry.py register|verify|list [names...]")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
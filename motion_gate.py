@@ -0,0 +1,82 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Cheap scene-change check run before detect_objects().
+
+    The frame is downsampled to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame that went through the model. When only a tiny
+    fraction of pixels changed (hovering drone, parked camera) the frame is gated
+    and the previous detections are reused. Comparing against the last inferred
+    frame rather than the previous one means slow drift still adds up and
+    eventually triggers a new inference; a drone pan changes almost every pixel
+    and is never gated.
+
+    Parameters:
+    - width: Width of the comparison thumbnail.
+    - pixel_delta: Grey-level difference for a pixel to count as changed.
+    - threshold: Fraction of changed pixels above which the model runs.
+    - max_skip: Force an inference after this many gated frames in a row.
+    """
+
+    def __init__(self, width=160, pixel_delta=12, threshold=0.02, max_skip=30):
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.reference = None
+        self.skipped_in_row = 0
+        self.checked = 0
+        self.gated = 0
+
+    def _thumbnail(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, int(height * self.width / width)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        # A light blur keeps sensor noise and compression artefacts from counting as motion
+        return cv2.GaussianBlur(gray, (3, 3), 0)
+
+    def should_infer(self, frame):
+        """
+        Returns:
+        - True when the scene changed enough (or too many frames were gated) and the
+          model should run; the frame then becomes the new reference.
+        """
+        self.checked += 1
+        thumbnail = self._thumbnail(frame)
+        if self.reference is not None and thumbnail.shape == self.reference.shape \
+                and self.skipped_in_row < self.max_skip:
+            changed = np.count_nonzero(cv2.absdiff(thumbnail, self.reference) > self.pixel_delta)
+            if changed / thumbnail.size < self.threshold:
+                self.skipped_in_row += 1
+                self.gated += 1
+                return False
+        self.reference = thumbnail
+        self.skipped_in_row = 0
+        return True
+
+    def format_report(self):
+        ratio = self.gated / self.checked if self.checked else 0.0
+        return f"{self.gated} of {self.checked} frames gated ({ratio:.0%} inference saved)"
+
+
+def motion_gate_from_env():
+    """MotionGate configured from the MOTION_* settings, or None unless MOTION_GATE=1."""
+    if os.getenv("MOTION_GATE", "0") != "1":
+        return None
+    gate = MotionGate(
+        pixel_delta=int(os.getenv("MOTION_PIXEL_DELTA", "12")),
+        threshold=float(os.getenv("MOTION_THRESHOLD", "0.02")),
+        max_skip=int(os.getenv("MOTION_MAX_SKIP", "30")),
+    )
+    logging.info(
+        f"Motion gate enabled: inference runs when more than {gate.threshold:.1%} of pixels change "
+        f"or after {gate.max_skip} gated frames."
+    )
+    return gate
@@ -0,0 +1,233 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+from dotenv import load_dotenv
+
+from detection_cache import DetectionCache
+from display_utils import display_from_env
+from frame_sources import LatestFrameReader
+from model_registry import load_model
+from stage_metrics import metrics_from_env
+from tuning_profile import apply_profile
+from video_writers import writer_from_env
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Load environment configurations
+load_dotenv()
+apply_profile()
+output_dir = os.getenv("OUTPUT_DIR", "output_videos")
+# Comma-separated stream URLs or local video files, one per drone
+stream_urls = [url.strip() for url in os.getenv("STREAM_URLS", "").split(",") if url.strip()]
+drone_names = [name.strip() for name in os.getenv("DRONE_NAMES", "").split(",") if name.strip()]
+max_batch = int(os.getenv("MAX_BATCH", "0")) or len(stream_urls)  # Frames per forward pass
+batch_wait = float(os.getenv("BATCH_WAIT_MS", "10")) / 1000  # How long to wait for a fuller batch
+pace_sources = os.getenv("PACE_SOURCES", "0") == "1"  # Play local files at their own FPS
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+default_fps = 30.0
+report_interval = 5.0
+
+model_repository = "ultralytics/yolov5"
+model_name = "yolov5x"  # 'yolov5n','yolov5s', 'yolov5m', 'yolov5l', 'yolov5x'
+
+proc_out_dir = os.path.join(output_dir, "processed_footage")
+os.makedirs(proc_out_dir, exist_ok=True)
+
+
+class StreamOutput:
+    """
+    Per-stream writer running in its own thread, so one slow disk or codec never
+    holds up the shared forward pass. When its queue is full the frame is dropped
+    and counted instead of waiting for the encoder.
+    """
+
+    def __init__(self, name, path, fps, queue_size=8):
+        self.name = name
+        self.path = path
+        self.fps = fps
+        self.writer = None
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"writer-{name}", daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.writer is None:
+                    height, width = frame.shape[:2]
+                    self.writer = writer_from_env(self.path, cv2.VideoWriter_fourcc(*"avc1"), self.fps, (width, height))
+                self.writer.write(frame)
+                self.written += 1
+            except Exception as e:
+                # Keep draining so the other streams and close() never wait on this one
+                self.error = e
+                logging.error(f"[{self.name}] Writer failed, its frames are no longer saved: {e}")
+
+    def close(self, timeout=5.0):
+        if self.thread.is_alive():
+            try:
+                self.frames.put(None, timeout=timeout)
+                self.thread.join(timeout=timeout)
+            except queue.Full:
+                pass
+        if self.thread.is_alive():
+            # Releasing under a writer that is still writing would corrupt the file anyway
+            logging.warning(f"[{self.name}] Writer still busy, {self.path} may be incomplete.")
+            return
+        if self.writer is not None:
+            try:
+                self.writer.release()
+            except Exception as e:
+                logging.error(f"[{self.name}] Could not finish {self.path}: {e}")
+
+
+class DroneStream:
+    """Reader, detection cache, output and counters of one drone."""
+
+    def __init__(self, name, url, names, current_time):
+        self.name = name
+        self.url = url
+        self.reader = LatestFrameReader(url, pace=pace_sources).start()
+        fps = self.reader.cap.get(cv2.CAP_PROP_FPS) or default_fps
+        self.cache = DetectionCache(names)
+        self.output = StreamOutput(
+            name, os.path.join(proc_out_dir, f"{name}_{model_name}_{current_time}.mp4"), fps
+        )
+        self.processed = 0
+        self.last_processed = 0
+
+    def throughput(self, elapsed):
+        fps = (self.processed - self.last_processed) / max(elapsed, 1e-6)
+        self.last_processed = self.processed
+        return fps
+
+
+def collect_batch(streams, start):
+    """
+    Take the newest unread frame of up to max_batch streams, visiting them round-robin
+    from `start` so that no stream is starved when there are more streams than slots.
+
+    Returns:
+    - list of (stream, frame, captured_at).
+    """
+    batch = []
+    deadline = time.time() + batch_wait
+    pending = [streams[(start + i) % len(streams)] for i in range(len(streams))]
+    while pending and len(batch) < max_batch:
+        still_pending = []
+        for stream in pending:
+            if len(batch) >= max_batch:
+                break
+            frame, captured_at = stream.reader.read_with_timestamp(timeout=0)
+            if frame is not None:
+                batch.append((stream, frame, captured_at))
+            elif not stream.reader.finished:
+                still_pending.append(stream)
+        pending = still_pending
+        if not pending or time.time() >= deadline:
+            break
+        if not batch:
+            # Nothing to work on yet: keep waiting instead of spinning on an empty batch
+            deadline = time.time() + batch_wait
+        time.sleep(0.002)
+    return batch
+
+
+def main():
+    if not stream_urls:
+        logging.error("No streams configured. Set STREAM_URLS to a comma-separated list of URLs or files.")
+        return
+
+    logging.info(f"Starting {model_name} on {len(stream_urls)} streams, up to {max_batch} frames per batch.")
+    try:
+        model = load_model(model_name)  # Pre-built copy from the local model registry
+        model.conf = 0.60
+        logging.info(f"{model_name} model loaded successfully.")
+    except Exception as e:
+        logging.error(f"Failed to load model: {e}")
+        return
+
+    current_time = datetime.now().strftime("%mm%d_%H%M")
+    names = [drone_names[i] if i < len(drone_names) else f"drone{i + 1}" for i in range(len(stream_urls))]
+    streams = [DroneStream(name, url, model.names, current_time) for name, url in zip(names, stream_urls)]
+    metrics = metrics_from_env()
+    display = display_from_env()
+
+    batches, next_start = 0, 0
+    started_at = last_report = time.time()
+    try:
+        while not all(stream.reader.finished for stream in streams):
+            batch = collect_batch(streams, next_start)
+            next_start = (next_start + 1) % len(streams)
+            if not batch:
+                continue
+
+            with metrics.timer("preprocess"):
+                frames_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for _, frame, _ in batch]
+            # One forward pass for every stream that had a new frame
+            with metrics.timer("inference"):
+                results = model(frames_rgb, size=inference_size)
+            batches += 1
+
+            for i, (stream, frame, captured_at) in enumerate(batch):
+                with metrics.timer("render"):
+                    stream.cache.update_from_results(results, i)
+                    processed_frame = stream.cache.draw(frame, copy=False)
+                with metrics.timer("encode"):
+                    stream.output.write(processed_frame)
+                display.show(f"Processed Stream {stream.name}", processed_frame)
+                stream.reader.record_display(captured_at)
+                stream.processed += 1
+
+            metrics.maybe_export()
+            if display.poll_key() == ord("q"):
+                break
+            if time.time() - last_report >= report_interval:
+                elapsed = time.time() - last_report
+                for stream in streams:
+                    logging.info(
+                        f"{stream.name}: {stream.throughput(elapsed):.1f} FPS processed, "
+                        f"{stream.reader.format_report()} writer dropped={stream.output.dropped}"
+                    )
+                last_report = time.time()
+    except KeyboardInterrupt:
+        logging.info("Interrupted by user.")
+    finally:
+        elapsed = max(time.time() - started_at, 1e-6)
+        for stream in streams:
+            stream.reader.stop()
+            stream.output.close()
+            logging.info(
+                f"{stream.name}: {stream.processed} frames processed ({stream.processed / elapsed:.1f} FPS), "
+                f"{stream.reader.dropped} dropped, {stream.output.dropped} not written by a slow writer, "
+                f"saved to {os.path.abspath(stream.output.path)}"
+            )
+        display.close()
+        if batches:
+            total = sum(stream.processed for stream in streams)
+            logging.info(f"{batches} batches, {total / batches:.2f} frames per forward pass on average.")
+            logging.info(f"Stage latency: {metrics.format_summary()}")
+            metrics.export()
+
+
+if __name__ == "__main__":
+    main()
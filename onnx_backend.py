@@ -0,0 +1,299 @@
+import inspect
+import json
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from detection_cache import DetectionCache
+from model_registry import ModelRegistry, artifact_stem, load_model, parse_name
+from tiled_inference import nms
+
+try:
+    import onnxruntime as ort
+except ImportError:  # The ONNX backend is optional; torch stays the default
+    ort = None
+
+# ONNX export of registered yolov5 models and an ONNX Runtime model with the
+# AutoShape call interface, so the scripts can swap it in through INFERENCE_BACKEND=onnx.
+#
+#   python onnx_backend.py yolov5x custom:exp5/best.pt
+OPSET = 13  # Per-channel INT8 (QDQ with an axis) needs 13
+STRIDE = 32
+
+
+def letterbox(image, shape, color=(114, 114, 114)):
+    """
+    Resize keeping the aspect ratio and pad to `shape` (height, width), centred, as AutoShape does.
+
+    Returns:
+    - (padded image, scale ratio, (left pad, top pad)).
+    """
+    height, width = image.shape[:2]
+    ratio = min(shape[0] / height, shape[1] / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    left = int(round((shape[1] - new_width) / 2 - 0.1))
+    top = int(round((shape[0] - new_height) / 2 - 0.1))
+    right, bottom = shape[1] - new_width - left, shape[0] - new_height - top
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, ratio, (left, top)
+
+
+def preprocess(images, size):
+    """
+    Scale RGB images so their longer side is `size` and letterbox them to one shape,
+    a multiple of the stride, as AutoShape does.
+
+    Returns:
+    - (float32 NCHW batch in 0-1, list of (ratio, pad) per image for mapping boxes back).
+    """
+    scaled = []
+    for image in images:
+        gain = size / max(image.shape[:2])
+        scaled.append([int(side * gain) for side in image.shape[:2]])
+    shape = [int(np.ceil(side / STRIDE) * STRIDE) for side in np.array(scaled).max(axis=0)]
+    batch, transforms = [], []
+    for image in images:
+        padded, ratio, pad = letterbox(image, shape)
+        batch.append(padded)
+        transforms.append((ratio, pad))
+    batch = np.ascontiguousarray(np.stack(batch).transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+    return batch, transforms
+
+
+class OnnxDetections:
+    """The parts of yolov5's Detections that the scripts use: xyxy, names and render()."""
+
+    def __init__(self, images, xyxy, names):
+        self.ims = images
+        self.xyxy = xyxy
+        self.names = names
+        self.n = len(images)
+
+    def __len__(self):
+        return self.n
+
+    def render(self):
+        cache = DetectionCache(self.names)
+        self.ims = [cache.draw(image, detections) for image, detections in zip(self.ims, self.xyxy)]
+        return self.ims
+
+
+class OnnxModel:
+    """
+    yolov5 ONNX model run by ONNX Runtime on the CPU, called like an AutoShape model.
+
+    model(images, size=640) takes one RGB image or a list of them. Each is scaled so
+    its longer side is `size`, and the batch is letterboxed to a common shape that
+    is a multiple of the stride, as AutoShape does. The raw predictions go through
+    confidence filtering and class-aware NMS, and the boxes are mapped back to the
+    original images.
+
+    Parameters:
+    - path: Exported .onnx file with dynamic batch, height and width.
+    - names: Class names, indexed by class id.
+    - threads: ONNX Runtime intra-op threads (0 lets it decide).
+    """
+
+    def __init__(self, path, names, threads=0):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = path
+        self.names = names
+        # Same knobs and defaults as AutoShape
+        self.conf = 0.25
+        self.iou = 0.45
+        self.classes = None
+        self.max_det = 1000
+
+    # Device moves are no-ops: the session always runs on the CPU
+    def to(self, device):
+        return self
+
+    def cpu(self):
+        return self
+
+    def eval(self):
+        return self
+
+    def _postprocess(self, prediction, ratio, pad, image_shape):
+        # Rows: cx, cy, w, h, objectness, one score per class
+        prediction = prediction[prediction[:, 4] > self.conf]
+        scores = prediction[:, 5:] * prediction[:, 4:5]
+        classes = scores.argmax(axis=1)
+        confidence = scores[np.arange(len(scores)), classes]
+        keep = confidence > self.conf
+        if self.classes is not None:
+            keep &= np.isin(classes, self.classes)
+        prediction, confidence, classes = prediction[keep], confidence[keep], classes[keep]
+
+        detections = np.empty((len(prediction), 6), dtype=np.float32)
+        detections[:, 0] = prediction[:, 0] - prediction[:, 2] / 2
+        detections[:, 1] = prediction[:, 1] - prediction[:, 3] / 2
+        detections[:, 2] = prediction[:, 0] + prediction[:, 2] / 2
+        detections[:, 3] = prediction[:, 1] + prediction[:, 3] / 2
+        detections[:, 4] = confidence
+        detections[:, 5] = classes
+        detections = nms(detections, self.iou, max_det=self.max_det)
+
+        detections[:, [0, 2]] = ((detections[:, [0, 2]] - pad[0]) / ratio).clip(0, image_shape[1])
+        detections[:, [1, 3]] = ((detections[:, [1, 3]] - pad[1]) / ratio).clip(0, image_shape[0])
+        return detections
+
+    def __call__(self, images, size=640):
+        images = list(images) if isinstance(images, (list, tuple)) else [images]
+        batch, transforms = preprocess(images, size)
+        predictions = self.session.run(None, {self.input_name: batch})[0]
+        xyxy = [
+            self._postprocess(prediction, ratio, pad, image.shape)
+            for prediction, (ratio, pad), image in zip(predictions, transforms, images)
+        ]
+        return OnnxDetections(images, xyxy, self.names)
+
+
+def onnx_paths(name, registry, variant=""):
+    """Paths of the .onnx file and its JSON sidecar; `variant` tags derived files, e.g. "int8-static"."""
+    stem = os.path.join(registry.root, artifact_stem(parse_name(name)[0]))
+    if variant:
+        stem += f".{variant}"
+    return stem + ".onnx", stem + ".onnx.json"
+
+
+def class_names(names):
+    """Class names as a list, from the list or dict exposed by model.names."""
+    if isinstance(names, dict):
+        return [names[i] for i in sorted(names)]
+    return list(names)
+
+
+def export_onnx(name, registry=None):
+    """
+    Export a registered model (registering it first if needed) to ONNX next to it.
+
+    The graph has dynamic batch, height and width, so any inference size and batch
+    works with one file. A JSON sidecar keeps the class names and the hash of the
+    registered model it came from.
+
+    Returns:
+    - Path of the .onnx file.
+    """
+    import torch
+
+    registry = registry or ModelRegistry()
+    model = load_model(name, registry, backend="torch")
+    path, meta_path = onnx_paths(name, registry)
+    start = time.perf_counter()
+
+    # AutoShape wraps DetectMultiBackend (hub models) or the DetectionModel itself
+    network = model.model.model if getattr(model, "dmb", False) else model.model
+    network = network.float().eval()
+    for module in network.modules():
+        if type(module).__name__ == "Detect":
+            # Grids follow the input shape, and only the concatenated predictions are returned
+            module.inplace = False
+            module.dynamic = True
+            module.export = True
+
+    options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        options["dynamo"] = False  # Newer torch defaults to the dynamo exporter
+    dummy = torch.zeros(1, 3, 640, 640)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            network,
+            dummy,
+            tmp_path,
+            opset_version=OPSET,
+            input_names=["images"],
+            output_names=["output0"],
+            dynamic_axes={"images": {0: "batch", 2: "height", 3: "width"}, "output0": {0: "batch", 1: "anchors"}},
+            do_constant_folding=True,
+            **options,
+        )
+    os.replace(tmp_path, path)
+
+    meta = {
+        "names": class_names(model.names),
+        "model_sha256": registry.entries()[parse_name(name)[0]]["sha256"],
+        "opset": OPSET,
+        "exported": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    logging.info(f"Exported {name} to {path} in {time.perf_counter() - start:.1f} s.")
+    return path
+
+
+def ensure_exported(name, registry):
+    """
+    Export `name` unless an export of the current registered model exists.
+
+    Returns:
+    - (path of the .onnx file, its sidecar metadata).
+    """
+    path, meta_path = onnx_paths(name, registry)
+    if registry.is_current(name) and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        current = meta.get("model_sha256") == registry.entries()[parse_name(name)[0]]["sha256"]
+        if current and meta.get("opset") == OPSET:
+            return path, meta
+    export_onnx(name, registry)
+    with open(meta_path) as f:
+        return path, json.load(f)
+
+
+def load_onnx_model(name, registry=None, quantization=None):
+    """
+    OnnxModel for `name`, exported on first use and again whenever the registered
+    model changed. ONNX_THREADS sets the intra-op threads (default 0, all cores).
+
+    Parameters:
+    - quantization: "dynamic" or "static" for the INT8 model made by quantize_model.py;
+      defaults to ONNX_QUANTIZATION (off). A dynamic model is made on the spot when
+      missing. A static one needs calibration images, so without it the fp32 model is used.
+    """
+    registry = registry or ModelRegistry()
+    path, meta = ensure_exported(name, registry)
+    quantization = os.getenv("ONNX_QUANTIZATION", "") if quantization is None else quantization
+    if quantization:
+        quantized_path, quantized_meta_path = onnx_paths(name, registry, f"int8-{quantization}")
+        current = False
+        if os.path.exists(quantized_path) and os.path.exists(quantized_meta_path):
+            with open(quantized_meta_path) as f:
+                current = json.load(f).get("model_sha256") == meta["model_sha256"]
+        if not current and quantization == "dynamic":
+            import onnx_quantization
+
+            try:
+                onnx_quantization.quantize(name, "dynamic", registry)
+                current = True
+            except ValueError as e:
+                logging.error(str(e))
+        if current:
+            path = quantized_path
+        else:
+            logging.warning(
+                f"No current INT8 {quantization} model for {name}: run quantize_model.py with "
+                f"QUANT_CALIBRATION_DIR first. Using the fp32 model."
+            )
+
+    model = OnnxModel(path, meta["names"], threads=int(os.getenv("ONNX_THREADS", "0")))
+    logging.info(f"Loaded {name} with ONNX Runtime from {path}.")
+    return model
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    for model_name in sys.argv[1:] or ["yolov5x"]:
+        export_onnx(model_name)
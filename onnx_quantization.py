@@ -0,0 +1,162 @@
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+
+import onnx_backend
+from model_registry import ModelRegistry
+
+try:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+except ImportError:  # Needs onnxruntime (and onnx); the rest of the repo runs without them
+    CalibrationDataReader = object
+    quantize_dynamic = quantize_static = quant_pre_process = None
+
+# Post-training INT8 quantization of an exported model with ONNX Runtime. Imported by
+# onnx_backend.py to make a missing dynamic model on the spot, and by quantize_model.py,
+# which also reports what the quantized models cost in mAP.
+#
+# "dynamic" stores the weights in INT8 and quantizes activations on the fly; it needs no
+# data. "static" also fixes the activation ranges up front from a folder of our images.
+CALIBRATION_METHODS = {
+    "minmax": "MinMax",
+    "entropy": "Entropy",
+    "percentile": "Percentile",
+}
+
+
+def list_images(folder, limit):
+    """Up to `limit` images of `folder`, spread evenly over the sorted file list."""
+    paths = sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.png") for path in glob.glob(os.path.join(folder, pattern))
+    )
+    if len(paths) > limit:
+        paths = [paths[i] for i in np.linspace(0, len(paths) - 1, limit).astype(int)]
+    return paths
+
+
+def read_rgb(path):
+    image = cv2.imread(path)
+    return None if image is None else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds calibration images to ONNX Runtime one at a time, preprocessed as at inference."""
+
+    def __init__(self, paths, input_name, size):
+        self.paths = paths
+        self.input_name = input_name
+        self.size = size
+        self.position = 0
+
+    def get_next(self):
+        while self.position < len(self.paths):
+            image = read_rgb(self.paths[self.position])
+            self.position += 1
+            if image is not None:
+                return {self.input_name: onnx_backend.preprocess([image], self.size)[0]}
+        return None
+
+    def rewind(self):
+        self.position = 0
+
+
+def head_nodes(path):
+    """
+    Nodes of the Detect head after its convolutions. They decode boxes in pixels and
+    confidences in 0-1 into one tensor, which a single INT8 scale cannot represent,
+    so they stay in fp32.
+    """
+    import onnx
+
+    nodes = onnx.load(path).graph.node
+    indices = [int(match.group(1)) for node in nodes for match in [re.search(r"/model\.(\d+)/", node.name)] if match]
+    if not indices:
+        logging.warning("Could not find the Detect head by node name, quantizing the whole graph.")
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [node.name for node in nodes if prefix in node.name and node.op_type != "Conv"]
+
+
+def quantize(name, mode, registry=None, calibration_dir="", calibration_images=200,
+             calibration_method="minmax", size=640):
+    """
+    Quantize the ONNX export of `name` to INT8 next to it.
+
+    Parameters:
+    - mode: "dynamic", or "static" (calibrated on calibration_dir).
+    - calibration_dir: Folder of images for static calibration.
+    - calibration_images: Most images to calibrate on, spread over the folder.
+    - calibration_method: "minmax", "entropy" or "percentile".
+    - size: Inference size the calibration images are preprocessed at.
+
+    Returns:
+    - Path of the quantized .onnx file.
+    """
+    if quantize_dynamic is None:
+        raise ValueError("Quantization needs onnxruntime and onnx (pip install onnxruntime onnx).")
+    registry = registry or ModelRegistry()
+    fp32_path, meta = onnx_backend.ensure_exported(name, registry)
+    path, meta_path = onnx_backend.onnx_paths(name, registry, f"int8-{mode}")
+    start = time.perf_counter()
+
+    # Shape inference and graph cleanup first, as ONNX Runtime recommends; optional
+    prepared_path = f"{path}.{os.getpid()}.prep.onnx"
+    try:
+        # Symbolic shape inference cannot follow the dynamic height and width
+        quant_pre_process(fp32_path, prepared_path, skip_symbolic_shape=True)
+    except Exception as e:
+        logging.warning(f"Pre-processing for quantization failed ({e}), quantizing the export as is.")
+        prepared_path = fp32_path
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    excluded = head_nodes(prepared_path)
+    quant_meta = {"names": meta["names"], "model_sha256": meta["model_sha256"], "mode": mode}
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(prepared_path, tmp_path, weight_type=QuantType.QUInt8, nodes_to_exclude=excluded)
+        elif mode == "static":
+            paths = list_images(calibration_dir, calibration_images) if calibration_dir else []
+            if not paths:
+                raise ValueError("Static quantization needs calibration images in QUANT_CALIBRATION_DIR.")
+            logging.info(f"Calibrating on {len(paths)} images of {calibration_dir} ({calibration_method}).")
+            input_name = onnx_backend.ort.InferenceSession(
+                prepared_path, providers=["CPUExecutionProvider"]
+            ).get_inputs()[0].name
+            quantize_static(
+                prepared_path,
+                tmp_path,
+                ImageCalibrationReader(paths, input_name, size),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=getattr(CalibrationMethod, CALIBRATION_METHODS[calibration_method]),
+                nodes_to_exclude=excluded,
+            )
+            quant_meta["calibration"] = {"dir": calibration_dir, "images": len(paths), "method": calibration_method}
+        else:
+            raise ValueError(f"Unknown quantization mode {mode}, use dynamic or static.")
+    finally:
+        if prepared_path != fp32_path and os.path.exists(prepared_path):
+            os.remove(prepared_path)
+    os.replace(tmp_path, path)
+
+    quant_meta["quantized"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(meta_path, "w") as f:
+        json.dump(quant_meta, f, indent=2)
+    logging.info(f"Quantized {name} ({mode}) to {path} in {time.perf_counter() - start:.1f} s.")
+    return path
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+import model_registry
+from detection_cache import DetectionCache, detections_from_results
+from detection_log import DetectionLog, detection_log_path, detections_only_from_env, load_detections
+from tuning_profile import apply_profile
+from video_writers import open_writer
+
+# Process one long recorded video as frame-range chunks in parallel worker processes.
+# The recorded-video scripts run at import time, so spawned workers cannot re-import them;
+# this is their chunked counterpart with the same .env settings.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+load_dotenv()
+apply_profile(set_threads=False)  # Workers size their own thread pools
+drone = os.getenv("DRONE_NAME", "your_drone")
+output_dir = os.getenv("OUTPUT_DIR", "output_videos")
+video_path = os.getenv("VIDEO_PATH", "path_to_your_video_file.mp4")
+model_name = os.getenv("MODEL_NAME", "yolov5x")  # Hub model name, or 'custom' together with MODEL_WEIGHTS
+model_weights = os.getenv("MODEL_WEIGHTS", "")
+model_conf = float(os.getenv("MODEL_CONF", "0.45"))
+detection_interval = int(os.getenv("DETECTION_INTERVAL", "1"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+cpu_count = os.cpu_count() or 1
+workers = int(os.getenv("PARALLEL_WORKERS", "0")) or max(1, cpu_count // 4)
+# Intra-op threads per worker: the cores are shared out instead of every worker grabbing all of them
+worker_threads = int(os.getenv("WORKER_THREADS", "0")) or max(1, cpu_count // workers)
+chunks_per_worker = int(os.getenv("CHUNKS_PER_WORKER", "1"))
+detections_only = detections_only_from_env()  # No rendered video, only the detection log
+
+
+def split_range(total, chunks):
+    """Split [0, total) into `chunks` contiguous (start, end) ranges of near-equal length."""
+    chunks = max(1, min(chunks, total))
+    bounds = np.linspace(0, total, chunks + 1).round().astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+# Models loaded by this worker process, reused by every chunk it is given
+_worker_models = {}
+
+
+def registry_name(name, weights):
+    return f"custom:{weights}" if weights else name
+
+
+def load_model(name, weights, conf):
+    model = model_registry.load_model(registry_name(name, weights))
+    model.conf = conf
+    return model
+
+
+def process_chunk(job):
+    """
+    Worker: decode frames [start, end) with a private capture and model, write the
+    annotated frames to the chunk video (unless job["render"] is off) and the
+    detections to the chunk's detection log.
+
+    Returns:
+    - dict with the chunk's start, end, frames processed and seconds spent.
+    """
+    import torch
+
+    torch.set_num_threads(job["threads"])
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already fixed once any parallel work ran in this process
+    # OpenCV would otherwise start its own pool of cpu_count threads in every worker
+    cv2.setNumThreads(1)
+
+    started = time.perf_counter()
+    key = (job["model_name"], job["model_weights"], job["model_conf"])
+    if key not in _worker_models:
+        _worker_models[key] = load_model(*key)
+    model = _worker_models[key]
+    cache = DetectionCache(model.names)
+
+    cap = cv2.VideoCapture(job["video_path"])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, job["start"])
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    while position < job["start"] and cap.grab():
+        position += 1  # The backend landed on an earlier keyframe
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    writer = open_writer(job["video_out"], cv2.VideoWriter_fourcc(*"avc1"), fps, size) if job["render"] else None
+    log = DetectionLog(job["detections_out"])
+
+    processed = 0
+    for index in range(job["start"], job["end"]):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        # The first frame of a chunk always runs the model, there is nothing cached yet
+        if index == job["start"] or index % job["interval"] == 0:
+            results = model(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), size=job["size"])
+            cache.update(detections_from_results(results))
+            log.append(index, index / fps, cache.detections)
+        if writer is not None:
+            writer.write(cache.draw(frame, copy=False))
+        processed += 1
+    cap.release()
+    if writer is not None:
+        writer.release()
+    log.close()
+    return {"start": job["start"], "end": job["end"], "frames": processed, "seconds": time.perf_counter() - started}
+
+
+def concat_videos(paths, output_path, fps, size):
+    """Join the chunk videos in order: stream copy with ffmpeg, or re-encode with OpenCV without it."""
+    if shutil.which("ffmpeg"):
+        list_path = output_path + ".txt"
+        with open(list_path, "w") as f:
+            f.writelines(f"file '{os.path.abspath(path)}'\n" for path in paths)
+        command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0",
+                   "-i", list_path, "-c", "copy", output_path]
+        result = subprocess.run(command, capture_output=True, text=True)
+        os.remove(list_path)
+        if result.returncode == 0:
+            return
+        logging.warning(f"ffmpeg concat failed, re-encoding the chunks: {result.stderr.strip()}")
+
+    writer = open_writer(output_path, cv2.VideoWriter_fourcc(*"avc1"), fps, size)
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            writer.write(frame)
+        cap.release()
+    writer.release()
+
+
+def concat_detections(paths, output_path):
+    """Join the chunk detection logs in order. Returns the number of rows."""
+    log = DetectionLog(output_path)
+    for path in paths:
+        log.extend(load_detections(path))
+    log.close()
+    return log.rows
+
+
+def main():
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error("Error opening video file.")
+        return
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+
+    os.makedirs(output_dir, exist_ok=True)
+    label = "custom" if model_weights else model_name
+    base = os.path.join(output_dir, f"{drone}_{label}_PROC_{datetime.now().strftime('%d_%H%M')}")
+    detections_path = detection_log_path(base)
+    chunk_dir = base + "_chunks"
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    ranges = split_range(total_frames, workers * chunks_per_worker)
+    jobs = [
+        {
+            "video_path": video_path, "start": start, "end": end,
+            "video_out": os.path.join(chunk_dir, f"chunk{i:04d}.mp4"),
+            "detections_out": os.path.join(chunk_dir, f"chunk{i:04d}{os.path.splitext(detections_path)[1]}"),
+            "model_name": model_name, "model_weights": model_weights, "model_conf": model_conf,
+            "interval": detection_interval, "size": inference_size, "threads": worker_threads,
+            "render": not detections_only,
+        }
+        for i, (start, end) in enumerate(ranges)
+    ]
+    logging.info(
+        f"Processing {total_frames} frames of {video_path} in {len(jobs)} chunks on {workers} workers "
+        f"with {worker_threads} threads each."
+    )
+
+    # Built once here, so the workers only load the pre-built copy
+    model_registry.ensure_registered(registry_name(model_name, model_weights))
+    started = time.perf_counter()
+    processed = 0
+    # spawn: torch and OpenCV thread pools do not survive a fork reliably
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(process_chunk, job) for job in jobs]
+        with tqdm(total=total_frames, desc="Processing Frames") as pbar:
+            for future in as_completed(futures):
+                result = future.result()
+                processed += result["frames"]
+                pbar.update(result["frames"])
+                logging.info(
+                    f"Chunk {result['start']}-{result['end']}: {result['frames']} frames "
+                    f"({result['frames'] / result['seconds']:.1f} FPS per worker)"
+                )
+
+    if not detections_only:
+        concat_videos([job["video_out"] for job in jobs], base + ".mp4", fps, size)
+    rows = concat_detections([job["detections_out"] for job in jobs], detections_path)
+    shutil.rmtree(chunk_dir)
+    elapsed = time.perf_counter() - started
+    logging.info(f"{processed} frames in {elapsed:.1f} s ({processed / elapsed:.1f} FPS overall), {rows} detections.")
+    if not detections_only:
+        logging.info(f"Processed video saved to: {os.path.abspath(base + '.mp4')}")
+    logging.info(f"Detections saved to: {os.path.abspath(detections_path)}")
+
+
+if __name__ == "__main__":
+    main()
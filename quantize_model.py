@@ -0,0 +1,241 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import psutil
+from dotenv import load_dotenv
+
+import onnx_backend
+from detection_cache import box_iou
+from model_registry import ModelRegistry, artifact_stem, parse_name
+from onnx_quantization import list_images, quantize, quantize_dynamic, read_rgb
+
+# Post-training INT8 quantization of an exported model with ONNX Runtime, and a report
+# of what it costs in mAP against what it saves in latency and memory.
+#
+#   QUANT_CALIBRATION_DIR=Dataset/images/train QUANT_EVAL_DIR=Dataset/images/val python quantize_model.py
+#
+# The quantization itself lives in onnx_quantization.py.
+load_dotenv()
+model_name = os.getenv("QUANT_MODEL", "custom:exp5/best.pt")
+modes = [mode for mode in os.getenv("QUANT_MODES", "dynamic,static").split(",") if mode]
+calibration_dir = os.getenv("QUANT_CALIBRATION_DIR", "")
+calibration_images = int(os.getenv("QUANT_CALIBRATION_IMAGES", "200"))
+calibration_method = os.getenv("QUANT_CALIBRATION_METHOD", "minmax")
+eval_dir = os.getenv("QUANT_EVAL_DIR", calibration_dir)
+eval_images = int(os.getenv("QUANT_EVAL_IMAGES", "200"))
+inference_size = int(os.getenv("INFERENCE_SIZE", "640"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def load_labels(image_path, shape):
+    """
+    Ground truth of an image from its YOLO label file (class cx cy w h, normalised),
+    found under the matching labels/ folder as in the yolov5 dataset layout, or next to it.
+
+    Returns:
+    - (N, 5) array of class, x1, y1, x2, y2 in pixels, or None without a label file.
+    """
+    stem = os.path.splitext(image_path)[0]
+    candidates = [stem + ".txt"]
+    head, sep, tail = stem.rpartition(f"{os.sep}images{os.sep}")
+    if sep:
+        candidates.insert(0, f"{head}{os.sep}labels{os.sep}{tail}.txt")
+    path = next((p for p in candidates if os.path.exists(p)), None)
+    if path is None:
+        return None
+    rows = np.loadtxt(path, ndmin=2, dtype=np.float32).reshape(-1, 5)
+    height, width = shape[:2]
+    labels = np.empty_like(rows)
+    labels[:, 0] = rows[:, 0]
+    labels[:, 1] = (rows[:, 1] - rows[:, 3] / 2) * width
+    labels[:, 2] = (rows[:, 2] - rows[:, 4] / 2) * height
+    labels[:, 3] = (rows[:, 1] + rows[:, 3] / 2) * width
+    labels[:, 4] = (rows[:, 2] + rows[:, 4] / 2) * height
+    return labels
+
+
+def average_precision(recall, precision):
+    """Area under the precision envelope, sampled at 101 recall points as in COCO."""
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    return float(np.interp(np.linspace(0, 1, 101), recall, precision).mean())
+
+
+def mean_average_precision(detections, truths):
+    """
+    mAP of per-image (N, 6) detections against (M, 5) class-first ground truth.
+
+    Returns:
+    - (mAP at IoU 0.5, mAP averaged over IoU 0.5:0.95).
+    """
+    thresholds = np.linspace(0.5, 0.95, 10)
+    counts = {}
+    confidences, classes, hits = [], [], []
+    for found, truth in zip(detections, truths):
+        for cls in truth[:, 0].astype(int):
+            counts[cls] = counts.get(cls, 0) + 1
+        if not len(found):
+            continue
+        found = found[np.argsort(-found[:, 4])]
+        tp = np.zeros((len(found), len(thresholds)), dtype=bool)
+        if len(truth):
+            iou = box_iou(found, truth[:, 1:5]) * (found[:, 5:6] == truth[None, :, 0])
+            for k, threshold in enumerate(thresholds):
+                taken = np.zeros(len(truth), dtype=bool)
+                for i in range(len(found)):
+                    candidates = np.flatnonzero((iou[i] >= threshold) & ~taken)
+                    if candidates.size:
+                        taken[candidates[iou[i, candidates].argmax()]] = True
+                        tp[i, k] = True
+        confidences.append(found[:, 4])
+        classes.append(found[:, 5].astype(int))
+        hits.append(tp)
+    if not counts:
+        return float("nan"), float("nan")
+    if not hits:
+        return 0.0, 0.0
+
+    confidences, classes, hits = np.concatenate(confidences), np.concatenate(classes), np.concatenate(hits)
+    aps = np.zeros((len(counts), len(thresholds)))
+    for row, (cls, count) in enumerate(counts.items()):
+        mask = classes == cls
+        if not mask.any():
+            continue
+        tp = hits[mask][np.argsort(-confidences[mask])]
+        true_positives, false_positives = tp.cumsum(axis=0), (~tp).cumsum(axis=0)
+        recall = true_positives / count
+        precision = true_positives / (true_positives + false_positives)
+        aps[row] = [average_precision(recall[:, k], precision[:, k]) for k in range(len(thresholds))]
+    return float(aps[:, 0].mean()), float(aps.mean())
+
+
+def session_memory(path, names, image):
+    """Resident memory in MB that a session adds up to the end of its first run."""
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    model = onnx_backend.OnnxModel(path, names)
+    model(image, size=inference_size)
+    return (process.memory_info().rss - rss_before) / 1e6
+
+
+def evaluate(path, names, images, threads=0):
+    """
+    Run one model file over the evaluation images, one image per call.
+
+    The timed pass uses the default confidence threshold, as in the scripts. The
+    detections for the mAP come from a second pass with the low threshold and
+    max_det of yolov5's val.py.
+
+    Returns:
+    - (detections per image, ms per image).
+    """
+    model = onnx_backend.OnnxModel(path, names, threads=threads)
+    model(images[0], size=inference_size)  # Untimed warm-up
+    start = time.perf_counter()
+    for image in images:
+        model(image, size=inference_size)
+    ms = (time.perf_counter() - start) * 1000 / len(images)
+
+    model.conf, model.max_det = 0.001, 300
+    detections = [model(image, size=inference_size).xyxy[0] for image in images]
+    return detections, ms
+
+
+def report(name, registry=None):
+    """
+    Compare the fp32 export with every quantized variant on QUANT_EVAL_DIR and write
+    <name>.quantization.json to the registry.
+
+    Without label files the fp32 detections above 0.25 confidence serve as the ground
+    truth, so the mAP then measures agreement with the fp32 model.
+    """
+    registry = registry or ModelRegistry()
+    fp32_path, meta = onnx_backend.ensure_exported(name, registry)
+    paths = list_images(eval_dir, eval_images) if eval_dir else []
+    images = [image for image in (read_rgb(path) for path in paths) if image is not None]
+    if not images:
+        logging.error("No evaluation images: set QUANT_EVAL_DIR (or QUANT_CALIBRATION_DIR).")
+        return None
+    if eval_dir == calibration_dir:
+        logging.warning("Evaluating on the calibration images: set QUANT_EVAL_DIR to held-out images.")
+
+    variants = [("fp32", fp32_path)]
+    for mode in modes:
+        path = onnx_backend.onnx_paths(name, registry, f"int8-{mode}")[0]
+        if os.path.exists(path):
+            variants.append((f"int8-{mode}", path))
+
+    threads = int(os.getenv("ONNX_THREADS", "0"))
+    results = {}
+    for variant, path in variants:
+        detections, ms = evaluate(path, meta["names"], images, threads)
+        # A fresh process each, so memory freed by the previous session does not hide the cost
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rss = pool.submit(session_memory, path, meta["names"], images[0]).result()
+        results[variant] = {
+            "file_mb": os.path.getsize(path) / 1e6,
+            "session_mb": rss,
+            "ms_per_image": ms,
+            "detections": detections,
+        }
+
+    labels = [load_labels(path, image.shape) for path, image in zip(paths, images)]
+    if any(label is not None for label in labels):
+        truths = [label if label is not None else np.zeros((0, 5), np.float32) for label in labels]
+        reference = "labels"
+    else:
+        truths = [found[found[:, 4] >= 0.25][:, [5, 0, 1, 2, 3]] for found in results["fp32"]["detections"]]
+        reference = "fp32 detections (no label files found)"
+
+    logging.info(f"{name} at size {inference_size} on {len(images)} images, mAP against {reference}:")
+    logging.info(f"{'model':<14}{'file MB':>9}{'RAM MB':>9}{'ms/img':>9}{'mAP50':>8}{'mAP50-95':>10}{'change':>9}")
+    for variant, result in results.items():
+        detections = result.pop("detections")
+        result["map50"], result["map50_95"] = mean_average_precision(detections, truths)
+        change = result["map50_95"] - results["fp32"]["map50_95"]
+        logging.info(
+            f"{variant:<14}{result['file_mb']:>9.1f}{result['session_mb']:>9.1f}{result['ms_per_image']:>9.1f}"
+            f"{result['map50']:>8.3f}{result['map50_95']:>10.3f}{change:>+9.3f}"
+        )
+
+    summary = {
+        "model": name,
+        "size": inference_size,
+        "images": len(images),
+        "eval_dir": eval_dir,
+        "reference": reference,
+        "results": results,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    report_path = os.path.join(registry.root, artifact_stem(parse_name(name)[0]) + ".quantization.json")
+    with open(report_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Report saved to {report_path}")
+    return summary
+
+
+def main():
+    registry = ModelRegistry()
+    for mode in modes:
+        try:
+            quantize(model_name, mode, registry, calibration_dir, calibration_images, calibration_method,
+                     inference_size)
+        except ValueError as e:
+            logging.error(f"Skipping {mode} quantization: {e}")
+    if quantize_dynamic is None:
+        return
+    report(model_name, registry)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        model_name = sys.argv[1]
+    main()
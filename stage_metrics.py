@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Stage names in the order they happen to a frame
+STAGES = ("decode", "preprocess", "inference", "render", "encode", "display")
+
+
+class StageMetrics:
+    """
+    Rolling per-stage latency histograms with p50/p95/p99 and periodic export.
+
+    Every stage keeps its last `window` samples. Thread-safe, so pipeline stages
+    can record from their own threads.
+
+    Parameters:
+    - window: Number of samples kept per stage.
+    - export_path: File to write periodically; None disables the export.
+    - export_format: "json" or "prometheus". Guessed from the extension when None
+      (.prom -> prometheus, anything else -> json).
+    - export_interval: Seconds between two exports.
+    """
+
+    def __init__(self, window=100, export_path=None, export_format=None, export_interval=10.0):
+        self.window = window
+        self.export_path = export_path
+        if export_format is None and export_path:
+            export_format = "prometheus" if export_path.endswith(".prom") else "json"
+        self.export_format = export_format
+        self.export_interval = export_interval
+        self.samples = {}
+        self.counts = {}
+        self.totals = {}  # Seconds over all samples, for the Prometheus _sum
+        self.lock = threading.Lock()
+        self.last_export = time.time()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+                self.totals[stage] = 0.0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+            self.totals[stage] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self):
+        """
+        Returns:
+        - dict stage -> {count, sum, mean, p50, p95, p99, max}, times in milliseconds,
+          known stages first in pipeline order. count and sum cover every sample,
+          the rest only the rolling window.
+        """
+        with self.lock:
+            snapshot = {
+                stage: (np.array(values), self.counts[stage], self.totals[stage])
+                for stage, values in self.samples.items()
+                if values
+            }
+        ordered = [s for s in STAGES if s in snapshot] + sorted(s for s in snapshot if s not in STAGES)
+        report = {}
+        for stage in ordered:
+            values, count, total = snapshot[stage]
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            report[stage] = {
+                "count": int(count),
+                "sum": float(total * 1000),
+                "mean": float(values.mean() * 1000),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(values.max() * 1000),
+            }
+        return report
+
+    def format_summary(self):
+        return " ".join(
+            f"{stage}[p50={s['p50']:.1f} p95={s['p95']:.1f} p99={s['p99']:.1f}ms]"
+            for stage, s in self.summary().items()
+        )
+
+    def _prometheus_text(self, report):
+        lines = [
+            "# HELP drone_vision_stage_latency_ms Per-frame stage latency over the rolling window.",
+            "# TYPE drone_vision_stage_latency_ms summary",
+        ]
+        for stage, s in report.items():
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                lines.append(f'drone_vision_stage_latency_ms{{stage="{stage}",quantile="{quantile}"}} {s[key]:.3f}')
+            lines.append(f'drone_vision_stage_latency_ms_sum{{stage="{stage}"}} {s["sum"]:.3f}')
+            lines.append(f'drone_vision_stage_latency_ms_count{{stage="{stage}"}} {s["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        if not self.export_path:
+            return
+        report = self.summary()
+        if self.export_format == "prometheus":
+            text = self._prometheus_text(report)
+        else:
+            text = json.dumps({"timestamp": time.time(), "window": self.window, "stages": report}, indent=2)
+        # Write then rename, so node_exporter or a dashboard never reads a half-written file
+        tmp_path = f"{self.export_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, self.export_path)
+        except OSError as e:
+            logging.error(f"Failed to write metrics to {self.export_path}: {e}")
+        self.last_export = time.time()
+
+    def maybe_export(self):
+        if self.export_path and time.time() - self.last_export >= self.export_interval:
+            self.export()
+
+
+def metrics_from_env(window=100):
+    """Build StageMetrics from METRICS_PATH, METRICS_FORMAT and METRICS_INTERVAL."""
+    export_path = os.getenv("METRICS_PATH") or None
+    metrics = StageMetrics(
+        window=window,
+        export_path=export_path,
+        export_format=os.getenv("METRICS_FORMAT") or None,
+        export_interval=float(os.getenv("METRICS_INTERVAL", "10")),
+    )
+    if export_path:
+        logging.info(f"Stage metrics will be written to {export_path} ({metrics.export_format}).")
+    return metrics
@@ -6,13 +6,35 @@ from imutils.video import VideoStream
 import time
 import os
 from dotenv import load_dotenv
-import os
+from adaptive_interval import controller_from_env
+from box_propagation import propagator_from_env
+from detection_cache import DetectionCache
+from display_utils import display_from_env
+from frame_sources import LatestFrameReader
+from model_cascade import cascade_from_env
+from model_registry import load_model
+from motion_gate import motion_gate_from_env
+from stage_metrics import metrics_from_env
+from stream_pipeline import StagePipeline
+from tiled_inference import tiled_detector_from_env
+from tuning_profile import apply_profile
+from video_writers import PassthroughRecorder, writer_from_env
+
+# Initialize logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Load environment configurations
 load_dotenv()
+apply_profile()
 drone = os.getenv('DRONE_NAME', 'your_drone')
 output_dir = os.getenv('OUTPUT_DIR', 'output_videos')
 stream_url = os.getenv('STREAM_URL', 'rtmp://your_stream_url/live')
+pipeline_mode = os.getenv('PIPELINE_MODE', '0') == '1'  # Run capture/inference/render/encode in separate threads
+pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '4'))
+live_ingest = os.getenv('LIVE_INGEST', '0') == '1'  # Always hand the detector the newest frame
+inference_size = int(os.getenv('INFERENCE_SIZE', '640'))
+# Unprocessed footage: 'encode' re-encodes decoded frames, 'passthrough' stream-copies with ffmpeg, 'off' skips it
+unproc_mode = os.getenv('UNPROC_MODE', 'encode')
 
 print(f"Drone: {drone}", f"Output directory: {output_dir}", f"Stream URL: {stream_url}", torch.cuda.is_available(), sep='\n')
 model_repository = 'ultralytics/yolov5'
@@ -26,40 +48,71 @@ os.makedirs(output_dir, exist_ok=True)
 os.makedirs(proc_out_dir, exist_ok=True)
 os.makedirs(unproc_out_dir, exist_ok=True)
 
-# Initialize logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info(f"Starting object detection with {model_name} on drone video stream!")
 
 try:
-    model = torch.hub.load(model_repository, model_name, pretrained=True)
+    model = load_model(model_name)  # Pre-built copy from the local model registry
     model.conf = 0.60
     logging.info(f"{model_name} model loaded successfully.")
 except Exception as e:
     logging.error(f"Failed to load model: {e}")
     exit()
 
-results = None
+# Last keyframe's boxes, drawn onto every following frame until the next keyframe
+detection_cache = DetectionCache(model.names)
+# Overlapping tiles at native resolution when TILED_INFERENCE=1, for small objects in 4K footage
+tiled_detector = tiled_detector_from_env(model)
+# Light model on every frame, this model only on uncertain or new objects when CASCADE=1
+cascade = cascade_from_env(model)
+# Moves the last keyframe's boxes with optical flow on the frames in between when BOX_PROPAGATION=1
+propagator = propagator_from_env()
+last_inference_time = None  # Seconds spent in the model on the latest keyframe, None otherwise
 
-def detect_objects(frame, update_detection):
-    global results
+def run_inference(frame, update_detection):
+    global last_inference_time
+    last_inference_time = None
     if update_detection:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = model(frame_rgb)
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    elif results:
-        frame_bgr = cv2.cvtColor(results.render()[0], cv2.COLOR_RGB2BGR)
-    else:
-        frame_bgr = frame
-    return frame_bgr
+        start = time.perf_counter()
+        with metrics.timer("preprocess"):
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with metrics.timer("inference"):
+            if tiled_detector:
+                detection_cache.update(tiled_detector(frame_rgb))
+            elif cascade:
+                detection_cache.update(cascade(frame_rgb, controller.size if controller else inference_size))
+            else:
+                results = model(frame_rgb, size=controller.size if controller else inference_size)
+                detection_cache.update_from_results(results)
+        last_inference_time = time.perf_counter() - start
+        if propagator:
+            propagator.reset(frame, detection_cache.detections)
+    elif propagator:
+        detection_cache.update(propagator.propagate(frame))
+    return detection_cache.detections
+
+def render_detections(frame, detections):
+    # Drawing in place is only safe when the frame is fresh and the raw frame is not encoded:
+    # VideoStream.read() hands out the same array until a new frame arrives, and in
+    # pipeline mode that array may still be on its way to inference
+    return detection_cache.draw(frame, detections, copy=unproc_mode == 'encode' or not live_ingest)
+
+def detect_objects(frame, update_detection):
+    return render_detections(frame, run_inference(frame, update_detection))
 
-# Initialization for FPS calculation
-frame_times = []
-frame_time_limit = 100  # Calculate average FPS over the last 100 frames
+# Initialization for FPS calculation and per-stage latency histograms
+frame_time_limit = 100  # Percentiles are computed over the last 100 frames of each stage
 default_fps = 30.0
+metrics = metrics_from_env(frame_time_limit)
+# GUI window, or nothing but the optional MJPEG preview when HEADLESS=1
+display = display_from_env()
 
 # Start video stream
-vs = VideoStream(stream_url).start()
-time.sleep(2.0)  # Warm-up time
+if live_ingest:
+    vs = LatestFrameReader(stream_url).start()
+    logging.info("Live ingest enabled: stale frames are dropped so detections follow the drone.")
+else:
+    vs = VideoStream(stream_url).start()
+    time.sleep(2.0)  # Warm-up time
 
 current_time = datetime.now().strftime("%mm%d_%H%M")
 processed_output_filename = f"{drone}_{model_name}_{current_time}.mp4"
@@ -67,46 +120,187 @@ unprocessed_output_filename = f"{drone}_{model_name}_{current_time}.mp4"
 proc_file_path = os.path.join(proc_out_dir, processed_output_filename)
 unproc_file_path = os.path.join(unproc_out_dir, unprocessed_output_filename)
 
+recorder = None
+if unproc_mode == 'passthrough':
+    if PassthroughRecorder.available():
+        # Opens its own connection to the stream and copies the bitstream untouched
+        recorder = PassthroughRecorder(stream_url, unproc_file_path).start()
+    else:
+        logging.error("ffmpeg not found, falling back to re-encoding the unprocessed footage.")
+        unproc_mode = 'encode'
+
 fourcc = cv2.VideoWriter_fourcc(*'avc1')
 proc_out, unproc_out = None, None
-frame_count, detection_interval, frames_processed = 0, 1, 0
+frame_count, detection_interval, frames_processed = 0, int(os.getenv('DETECTION_INTERVAL', '1')), 0
+# Tunes detection_interval (and optionally the inference size) at runtime when ADAPTIVE_INTERVAL=1
+controller = controller_from_env(default_fps)
+
+# Reuses the previous detections on static frames when MOTION_GATE=1
+motion_gate = motion_gate_from_env()
 
 prev_time = time.time()
+report_interval = 5.0  # Seconds between drop/lag and occupancy log lines
 
 
-try:
+def read_frame():
+    with metrics.timer("decode"):
+        if live_ingest:
+            return vs.read_with_timestamp()
+        return vs.read(), time.time()
+
+
+def is_keyframe(index, frame):
+    if controller:
+        keyframe = controller.should_detect()
+    else:
+        keyframe = index % detection_interval == 0
+    # Only keyframes pay for the motion check; gated ones keep the cached boxes
+    return keyframe and (motion_gate is None or motion_gate.should_infer(frame))
+
+
+def open_writers(frame, fps):
+    global proc_out, unproc_out
+    height, width = frame.shape[:2]
+    proc_out = writer_from_env(proc_file_path, fourcc, fps, (width, height))
+    if unproc_mode == 'encode':
+        unproc_out = writer_from_env(unproc_file_path, fourcc, fps, (width, height))
+
+
+def run_sequential():
+    global frame_count, prev_time
+    last_report = time.time()
     while True:
-        frame = vs.read()
+        frame, captured_at = read_frame()
         if frame is None:
             logging.error("Empty frame received. End of stream?")
             break
 
-        update_detection = frame_count % detection_interval == 0
-        processed_frame = detect_objects(frame, update_detection)
+        frame_start = time.perf_counter()
+        update_detection = is_keyframe(frame_count, frame)
+        detections = run_inference(frame, update_detection)
 
         # Calculate FPS
         current_time = time.time()
         fps = 1 / (current_time - prev_time)
         prev_time = current_time
 
-        # Display FPS on the frame
-        cv2.putText(processed_frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        # Initialize VideoWriter objects if not already done
-        if proc_out is None or unproc_out is None:
-            height, width = frame.shape[:2]
-            proc_out = cv2.VideoWriter(proc_file_path, fourcc, fps, (width, height))
-            unproc_out = cv2.VideoWriter(unproc_file_path, fourcc, fps, (width, height))
-        # Save frames to videos
-        unproc_out.write(frame)  # Save original frame to unprocessed video
-        proc_out.write(processed_frame)  # Save processed frame to processed video
-        
+        with metrics.timer("render"):
+            processed_frame = render_detections(frame, detections)
+            # Display FPS on the frame
+            cv2.putText(processed_frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        with metrics.timer("encode"):
+            # Initialize VideoWriter objects if not already done
+            if proc_out is None:
+                open_writers(frame, fps)
+            # Save frames to videos
+            if unproc_out:
+                unproc_out.write(frame)  # Save original frame to unprocessed video
+            proc_out.write(processed_frame)  # Save processed frame to processed video
+
         # Display the frames
-        cv2.imshow('Processed Stream', processed_frame)
+        with metrics.timer("display"):
+            display.show('Processed Stream', processed_frame)
+            key = display.poll_key()
+        metrics.maybe_export()
+        if live_ingest:
+            vs.record_display(captured_at)
+            if time.time() - last_report >= report_interval:
+                logging.info(f"Live ingest: {vs.format_report()}")
+                last_report = time.time()
 
+        if controller:
+            controller.record_frame(time.perf_counter() - frame_start, last_inference_time)
 
         frame_count += 1
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if key == ord('q'):
             break
+
+
+def capture_stage():
+    global frame_count
+    frame, captured_at = read_frame()
+    if frame is None:
+        logging.error("Empty frame received. End of stream?")
+        return None
+    item = {"index": frame_count, "frame": frame, "captured_at": captured_at}
+    frame_count += 1
+    return item
+
+
+def inference_stage(item):
+    stage_start = time.perf_counter()
+    item["detections"] = run_inference(item["frame"], is_keyframe(item["index"], item["frame"]))
+    if controller:
+        # Stages overlap, so only the inference stage's own time bounds the output rate
+        controller.record_frame(time.perf_counter() - stage_start, last_inference_time)
+    return item
+
+
+def render_stage(item):
+    global prev_time
+    with metrics.timer("render"):
+        processed_frame = render_detections(item["frame"], item["detections"])
+        current_time = time.time()
+        fps = 1 / max(current_time - prev_time, 1e-6)
+        prev_time = current_time
+        cv2.putText(processed_frame, f"FPS: {fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    item["processed"] = processed_frame
+    return item
+
+
+def encode_stage(item):
+    with metrics.timer("encode"):
+        if proc_out is None:
+            # The measured FPS is meaningless before the pipeline has filled up
+            open_writers(item["frame"], default_fps)
+        if unproc_out:
+            unproc_out.write(item["frame"])
+        proc_out.write(item["processed"])
+    return item
+
+
+def run_pipeline():
+    pipeline = StagePipeline(queue_size=pipeline_queue_size)
+    pipeline.add_stage("capture", capture_stage)
+    # In live mode inference only ever sees the newest captured frame
+    pipeline.add_stage("inference", inference_stage, latest_only=live_ingest)
+    pipeline.add_stage("render", render_stage)
+    pipeline.add_stage("encode", encode_stage)
+    pipeline.start()
+    logging.info(f"Pipeline mode enabled with queue size {pipeline_queue_size}.")
+
+    last_report = time.time()
+    try:
+        # Display stays on the main thread, HighGUI does not like being driven from workers
+        while True:
+            try:
+                item = pipeline.get()
+            except StopIteration:
+                break
+            with metrics.timer("display"):
+                if item is not None:
+                    display.show('Processed Stream', item["processed"])
+                key = display.poll_key()
+            if item is not None and live_ingest:
+                vs.record_display(item["captured_at"])
+            metrics.maybe_export()
+            if key == ord('q'):
+                break
+            if time.time() - last_report >= report_interval:
+                logging.info(f"Pipeline occupancy: {pipeline.format_occupancy()}")
+                if live_ingest:
+                    logging.info(f"Live ingest: {vs.format_report()} pipeline dropped={pipeline.dropped()}")
+                last_report = time.time()
+    finally:
+        pipeline.stop()
+        logging.info(f"Final pipeline occupancy: {pipeline.format_occupancy()}")
+
+
+try:
+    if pipeline_mode:
+        run_pipeline()
+    else:
+        run_sequential()
 except KeyboardInterrupt:
     logging.info("Interrupted by user.")
 finally:
@@ -115,7 +309,16 @@ finally:
         proc_out.release()
     if unproc_out:
         unproc_out.release()
-    cv2.destroyAllWindows()
+    if recorder:
+        recorder.stop()
+    display.close()
+    if metrics.summary():
+        logging.info(f"Stage latency: {metrics.format_summary()}")
+        metrics.export()
+    if motion_gate:
+        logging.info(f"Motion gate: {motion_gate.format_report()}")
+    if cascade:
+        logging.info(f"Cascade: {cascade.format_report()}")
 
     # Log the outcome of the video processing
     if frame_count > 0:
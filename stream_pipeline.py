@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+
+# Marker pushed through the queues once the source runs dry or the pipeline is stopped
+_END = object()
+
+
+class LatestQueue(queue.Queue):
+    """
+    Single-slot queue where a new item replaces the one still waiting, so the
+    consuming stage always works on the newest input. Replaced items are counted.
+    The end marker never replaces an item; it waits behind the last one.
+    """
+
+    def __init__(self):
+        super().__init__(maxsize=1)
+        self.replaced = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._qsize() and item is not _END:
+                self._get()
+                self.replaced += 1
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class Stage:
+    """
+    One worker thread of a StagePipeline.
+
+    Parameters:
+    - name: Stage name used in logs and occupancy reports.
+    - func: Callable taking the item from the previous stage and returning the item
+      for the next one. Returning None drops the item. The first stage is called
+      with no arguments and returning None ends the pipeline.
+    - latest_only: Feed the stage through a LatestQueue instead of a bounded FIFO.
+    """
+
+    def __init__(self, name, func, latest_only=False):
+        self.name = name
+        self.func = func
+        self.latest_only = latest_only
+        self.in_queue = None
+        self.out_queue = None
+        self.thread = None
+        self.processed = 0
+        self.busy_time = 0.0
+
+
+class StagePipeline:
+    """
+    Runs capture -> ... -> sink stages in their own threads joined by bounded queues,
+    so the slowest stage no longer caps every other stage.
+
+    The last queue is drained by the caller through get(), which lets the display
+    stage stay on the main thread as required by cv2.imshow.
+    """
+
+    def __init__(self, queue_size=4):
+        self.queue_size = queue_size
+        self.stages = []
+        self.output = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.started_at = None
+
+    def add_stage(self, name, func, latest_only=False):
+        self.stages.append(Stage(name, func, latest_only))
+        return self
+
+    def start(self):
+        if not self.stages:
+            raise ValueError("StagePipeline needs at least one stage.")
+        for prev, stage in zip(self.stages, self.stages[1:]):
+            stage.in_queue = LatestQueue() if stage.latest_only else queue.Queue(maxsize=self.queue_size)
+            prev.out_queue = stage.in_queue
+        self.stages[-1].out_queue = self.output
+        self.started_at = time.time()
+        for stage in self.stages:
+            stage.thread = threading.Thread(
+                target=self._run_stage, args=(stage,), name=f"stage-{stage.name}", daemon=True
+            )
+            stage.thread.start()
+        return self
+
+    def _put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run_stage(self, stage):
+        try:
+            while not self.stop_event.is_set():
+                if stage.in_queue is None:
+                    item = None
+                else:
+                    try:
+                        item = stage.in_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is _END:
+                        break
+
+                start = time.perf_counter()
+                result = stage.func() if stage.in_queue is None else stage.func(item)
+                stage.busy_time += time.perf_counter() - start
+
+                if result is None:
+                    if stage.in_queue is None:
+                        break
+                    continue
+                stage.processed += 1
+                if not self._put(stage.out_queue, result):
+                    break
+        except Exception as e:
+            logging.error(f"Pipeline stage '{stage.name}' failed: {e}")
+            self.stop_event.set()
+        finally:
+            # Always let the downstream stage know nothing more is coming
+            try:
+                stage.out_queue.put(_END, timeout=1.0)
+            except queue.Full:
+                self.stop_event.set()
+
+    def get(self, timeout=0.1):
+        """
+        Fetch the next item from the last stage.
+
+        Returns:
+        - The item, None if nothing arrived within the timeout, or raises
+          StopIteration once every stage has finished.
+        """
+        try:
+            item = self.output.get(timeout=timeout)
+        except queue.Empty:
+            if self.stop_event.is_set():
+                raise StopIteration
+            return None
+        if item is _END:
+            raise StopIteration
+        return item
+
+    def occupancy(self):
+        """
+        Snapshot of every stage: input queue depth, items processed and the
+        fraction of wall time the stage spent busy.
+        """
+        elapsed = max(time.time() - (self.started_at or time.time()), 1e-6)
+        report = {}
+        for stage in self.stages:
+            report[stage.name] = {
+                "queued": stage.in_queue.qsize() if stage.in_queue is not None else 0,
+                "processed": stage.processed,
+                "busy": min(stage.busy_time / elapsed, 1.0),
+            }
+        report["output"] = {"queued": self.output.qsize()}
+        return report
+
+    def dropped(self):
+        """Items replaced in latest-only queues before their stage picked them up."""
+        return sum(stage.in_queue.replaced for stage in self.stages if isinstance(stage.in_queue, LatestQueue))
+
+    def format_occupancy(self):
+        parts = []
+        for name, stats in self.occupancy().items():
+            if "busy" in stats:
+                parts.append(f"{name}[q={stats['queued']} n={stats['processed']} busy={stats['busy']:.0%}]")
+            else:
+                parts.append(f"{name}[q={stats['queued']}]")
+        return " ".join(parts)
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.thread.join(timeout=timeout)
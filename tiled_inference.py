@@ -0,0 +1,147 @@
+import logging
+import os
+
+import numpy as np
+
+from detection_cache import EMPTY_DETECTIONS, detections_from_results
+
+
+def tile_origins(length, tile_size, overlap):
+    """
+    Start offsets of overlapping tiles along one axis. The last tile is aligned to
+    the far edge so every pixel is covered without padding.
+    """
+    if length <= tile_size:
+        return [0]
+    step = max(1, int(tile_size * (1 - overlap)))
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def make_tiles(frame, tile_size, overlap):
+    """
+    Cut a frame into overlapping tiles.
+
+    Returns:
+    - list of (x0, y0, tile) where tile is a view into the frame.
+    """
+    height, width = frame.shape[:2]
+    return [
+        (x0, y0, frame[y0:y0 + tile_size, x0:x0 + tile_size])
+        for y0 in tile_origins(height, tile_size, overlap)
+        for x0 in tile_origins(width, tile_size, overlap)
+    ]
+
+
+def nms(detections, threshold=0.45, metric="iou", max_det=0):
+    """
+    Class-aware greedy non-maximum suppression on an (N, 6) detections array.
+
+    Overlaps of the kept box against all remaining boxes are computed in one
+    vectorized step per kept box. Boxes of different classes never suppress
+    each other.
+
+    Parameters:
+    - detections: float array, rows of x1, y1, x2, y2, confidence, class.
+    - threshold: Boxes overlapping a better one by more than this are dropped.
+    - metric: "iou", or "ios" (intersection over the smaller box). "ios" also catches
+      a box truncated at a tile seam lying inside the full box from the next tile.
+    - max_det: Stop once this many boxes are kept (0 keeps all).
+
+    Returns:
+    - The kept rows, highest confidence first.
+    """
+    if len(detections) < 2:
+        return detections
+    detections = detections[np.argsort(-detections[:, 4])]
+    # Shift each class into its own coordinate range so one pass handles all classes
+    offset = detections[:, 5:6] * (detections[:, :4].max() + 1)
+    boxes = detections[:, :4] + offset
+    areas = (boxes[:, 2] - boxes[:, 0]).clip(0) * (boxes[:, 3] - boxes[:, 1]).clip(0)
+
+    keep = []
+    remaining = np.arange(len(detections))
+    while remaining.size:
+        best, rest = remaining[0], remaining[1:]
+        keep.append(best)
+        if not rest.size or len(keep) == max_det:
+            break
+        width = (np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0])).clip(0)
+        height = (np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1])).clip(0)
+        inter = width * height
+        if metric == "ios":
+            overlap = inter / np.maximum(np.minimum(areas[best], areas[rest]), 1e-6)
+        else:
+            overlap = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-6)
+        remaining = rest[overlap <= threshold]
+    return detections[keep]
+
+
+class TiledDetector:
+    """
+    Sliced inference for high-resolution frames.
+
+    Each frame is cut into overlapping tile_size tiles that the model sees at native
+    resolution, so small or distant objects survive. The tiles run in batches of
+    batch_size, their boxes are shifted back to frame coordinates, and duplicates
+    along the seams are merged with nms(). An optional full-frame pass keeps large
+    objects that no single tile contains.
+
+    Parameters:
+    - model: torch.hub yolov5 model (AutoShape), called with lists of RGB images.
+    - tile_size: Tile edge in pixels, also used as the inference size of the tiles.
+    - overlap: Fraction of a tile shared with its neighbour.
+    - batch_size: Tiles per forward pass.
+    - merge_threshold, merge_metric: Passed to nms() when merging.
+    - full_frame_size: Inference size of the extra full-frame pass, 0 disables it.
+    """
+
+    def __init__(self, model, tile_size=640, overlap=0.2, batch_size=8, merge_threshold=0.6,
+                 merge_metric="ios", full_frame_size=640):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = max(1, batch_size)
+        self.merge_threshold = merge_threshold
+        self.merge_metric = merge_metric
+        self.full_frame_size = full_frame_size
+
+    def __call__(self, frame_rgb):
+        """
+        Returns:
+        - (N, 6) float32 detections in frame coordinates.
+        """
+        tiles = make_tiles(frame_rgb, self.tile_size, self.overlap)
+        found = []
+        for start in range(0, len(tiles), self.batch_size):
+            batch = tiles[start:start + self.batch_size]
+            results = self.model([tile for _, _, tile in batch], size=self.tile_size)
+            for i, (x0, y0, _) in enumerate(batch):
+                detections = detections_from_results(results, i).copy()
+                detections[:, [0, 2]] += x0
+                detections[:, [1, 3]] += y0
+                found.append(detections)
+        if self.full_frame_size:
+            found.append(detections_from_results(self.model(frame_rgb, size=self.full_frame_size)))
+        if not found:
+            return EMPTY_DETECTIONS
+        return nms(np.concatenate(found), self.merge_threshold, self.merge_metric)
+
+
+def tiled_detector_from_env(model):
+    """TiledDetector configured from the TILE_* settings, or None unless TILED_INFERENCE=1."""
+    if os.getenv("TILED_INFERENCE", "0") != "1":
+        return None
+    detector = TiledDetector(
+        model,
+        tile_size=int(os.getenv("TILE_SIZE", "640")),
+        overlap=float(os.getenv("TILE_OVERLAP", "0.2")),
+        batch_size=int(os.getenv("TILE_BATCH", "8")),
+        full_frame_size=int(os.getenv("TILE_FULL_FRAME_SIZE", "640")),
+    )
+    logging.info(
+        f"Tiled inference enabled: {detector.tile_size}px tiles, {detector.overlap:.0%} overlap, "
+        f"batches of {detector.batch_size}"
+    )
+    return detector
@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import platform
+
+# Settings an autotune profile may provide, as environment variable names
+PROFILE_SETTINGS = (
+    "INFERENCE_SIZE",
+    "INFERENCE_BATCH",
+    "TORCH_THREADS",
+    "TORCH_INTEROP_THREADS",
+    "ONNX_THREADS",
+    "PARALLEL_WORKERS",
+    "BATCH_JOBS",
+    "WORKER_THREADS",
+)
+
+
+def machine_fingerprint():
+    """What a profile is only valid for: the same host with the same cores."""
+    return {
+        "hostname": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def profile_path():
+    return os.getenv("AUTOTUNE_PROFILE", "autotune_profile.json")
+
+
+def apply_threads():
+    """Size torch's thread pools from TORCH_THREADS and TORCH_INTEROP_THREADS, when set."""
+    threads = int(os.getenv("TORCH_THREADS", "0"))
+    interop = int(os.getenv("TORCH_INTEROP_THREADS", "0"))
+    if not threads and not interop:
+        return
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop:
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError:
+            pass  # Already fixed once any parallel work ran in this process
+
+
+def apply_profile(set_threads=True):
+    """
+    Fill in the settings of the profile written by autotune.py that neither the
+    environment nor the .env file set, so explicit settings always win. Call it right
+    after load_dotenv(). AUTOTUNE=0 ignores the profile, and so does a profile made on
+    another machine.
+
+    Parameters:
+    - set_threads: Also size torch's thread pools; off for scripts whose worker
+      processes set their own.
+
+    Returns:
+    - dict of the settings taken from the profile.
+    """
+    path = profile_path()
+    if os.getenv("AUTOTUNE", "1") == "0" or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        profile = json.load(f)
+    if profile.get("machine") != machine_fingerprint():
+        logging.warning(
+            f"{path} was tuned on {profile.get('machine', {}).get('hostname')}, not this machine; "
+            f"ignoring it. Run python autotune.py here."
+        )
+        return {}
+
+    applied = {
+        name: str(value)
+        for name, value in profile.get("settings", {}).items()
+        if name in PROFILE_SETTINGS and name not in os.environ
+    }
+    os.environ.update(applied)
+    if set_threads:
+        apply_threads()
+    if applied:
+        logging.info(f"Autotune profile {path}: {applied}")
+    return applied
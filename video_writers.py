@@ -0,0 +1,420 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# Queued after the last frame of a segment so its worker closes the file
+_SEGMENT_END = object()
+
+# Candidate encoders. H.264 ones are ranked by measured speed; the rest are only fallbacks.
+H264_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf", "libx264", "libopenh264")
+FALLBACK_ENCODERS = ("mpeg4",)
+# Encoders that understand x264-style -preset names (ultrafast ... veryslow)
+_X264_PRESET_ENCODERS = {"libx264", "libx265"}
+
+
+def probe_encoders(ffmpeg="ffmpeg"):
+    """
+    Encoders that actually work on this machine, fastest first.
+
+    Being listed by `ffmpeg -encoders` is not enough for hardware encoders (nvenc is
+    compiled in on machines without an NVIDIA GPU), so every candidate encodes a
+    short 720p test clip. Working H.264 encoders are sorted by how long that took;
+    FALLBACK_ENCODERS come after them. The result is cached per ffmpeg executable.
+    """
+    return _probe_encoders(ffmpeg)
+
+
+@lru_cache(maxsize=None)
+def _probe_encoders(ffmpeg):
+    if not shutil.which(ffmpeg):
+        return ()
+    listed = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    timings = {}
+    for encoder in H264_ENCODERS + FALLBACK_ENCODERS:
+        if f" {encoder} " not in listed:
+            continue
+        command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                   "-i", "testsrc2=size=1280x720:rate=30", "-frames:v", "30", "-c:v", encoder]
+        if encoder in _X264_PRESET_ENCODERS:
+            command += ["-preset", "ultrafast"]
+        start = time.perf_counter()
+        trial = subprocess.run(command + ["-pix_fmt", "yuv420p", "-f", "null", "-"], capture_output=True)
+        if trial.returncode == 0:
+            timings[encoder] = time.perf_counter() - start
+    working = sorted((e for e in timings if e in H264_ENCODERS), key=timings.get)
+    working += [e for e in FALLBACK_ENCODERS if e in timings]
+    logging.info("Working ffmpeg encoders: " + (", ".join(f"{e} ({timings[e] * 1000:.0f}ms)" for e in working) or "none"))
+    return tuple(working)
+
+
+class FFmpegPipeWriter:
+    """
+    cv2.VideoWriter replacement that streams raw BGR frames into an ffmpeg
+    subprocess, which encodes them with a selectable encoder, preset and thread count.
+
+    Parameters:
+    - path: Output file.
+    - fps, frame_size: As for cv2.VideoWriter; frame_size is (width, height).
+    - codec: ffmpeg encoder name. None picks the first working one from probe_encoders().
+    - preset: Speed preset for x264/x265 (ultrafast ... veryslow).
+    - threads: Encoder threads, 0 lets ffmpeg decide.
+    - crf: Constant rate factor for x264/x265.
+    """
+
+    def __init__(self, path, fps, frame_size, codec=None, preset="veryfast", threads=0, crf=23, ffmpeg="ffmpeg"):
+        self.path = path
+        self.frame_size = tuple(frame_size)
+        if codec is None:
+            encoders = probe_encoders(ffmpeg)
+            codec = encoders[0] if encoders else "mpeg4"
+        self.codec = codec
+        command = [
+            ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{self.frame_size[0]}x{self.frame_size[1]}", "-r", f"{fps}",
+            "-i", "-",
+            "-c:v", codec, "-pix_fmt", "yuv420p",
+        ]
+        if codec in _X264_PRESET_ENCODERS:
+            command += ["-preset", preset, "-crf", str(crf)]
+        if threads:
+            command += ["-threads", str(threads)]
+        command.append(path)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        if frame.shape[1::-1] != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            errors = self.process.stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(f"ffmpeg writer for {self.path} stopped: {errors}")
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        self.process.wait()
+        errors = self.process.stderr.read().decode(errors="replace").strip()
+        if self.process.returncode != 0:
+            logging.error(f"ffmpeg writer for {self.path} exited with {self.process.returncode}: {errors}")
+        self.process = None
+
+
+def open_writer(path, fourcc, fps, frame_size):
+    """
+    Open a single video file with the backend chosen by WRITER_BACKEND.
+
+    - opencv (default): cv2.VideoWriter with the script's fourcc. When OpenCV cannot
+      open that fourcc (avc1 is missing from many builds), fall back to the ffmpeg
+      pipe if ffmpeg is installed, else to mp4v.
+    - ffmpeg: FFmpegPipeWriter with FFMPEG_CODEC (default: fastest working encoder),
+      FFMPEG_PRESET (default veryfast) and FFMPEG_THREADS (default 0, ffmpeg decides).
+    """
+    backend = os.getenv("WRITER_BACKEND", "opencv")
+    if backend == "ffmpeg" and shutil.which("ffmpeg"):
+        return FFmpegPipeWriter(
+            path, fps, frame_size,
+            codec=os.getenv("FFMPEG_CODEC") or None,
+            preset=os.getenv("FFMPEG_PRESET", "veryfast"),
+            threads=int(os.getenv("FFMPEG_THREADS", "0")),
+        )
+    if backend == "ffmpeg":
+        logging.error("WRITER_BACKEND=ffmpeg but ffmpeg was not found, using OpenCV.")
+
+    writer = cv2.VideoWriter(path, fourcc, fps, frame_size)
+    if writer.isOpened():
+        return writer
+    if shutil.which("ffmpeg"):
+        logging.warning(f"OpenCV could not open {path} with the requested fourcc, using the ffmpeg pipe writer.")
+        return FFmpegPipeWriter(path, fps, frame_size)
+    logging.warning(f"OpenCV could not open {path} with the requested fourcc, falling back to mp4v.")
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, frame_size)
+
+
+class PassthroughRecorder:
+    """
+    Archives a stream exactly as the drone sent it by stream-copying it to disk
+    through an ffmpeg subprocess. Nothing is decoded or re-encoded; the Python
+    side only decodes the frames it needs for inference.
+
+    The MP4 is written fragmented, so a recording cut short by a crash is still
+    playable up to the last fragment.
+
+    Parameters:
+    - src: Stream URL (rtmp://, rtsp://, ...) or file to copy.
+    - path: Output file.
+    - ffmpeg: ffmpeg executable.
+    """
+
+    def __init__(self, src, path, ffmpeg="ffmpeg"):
+        self.src = src
+        self.path = path
+        self.ffmpeg = ffmpeg
+        self.process = None
+
+    @staticmethod
+    def available(ffmpeg="ffmpeg"):
+        return shutil.which(ffmpeg) is not None
+
+    def start(self):
+        command = [
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-i", self.src,
+            "-map", "0", "-c", "copy",
+            "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+            self.path,
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        logging.info(f"Recording the raw stream without re-encoding to {self.path}")
+        return self
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=10.0):
+        if self.process is None:
+            return
+        if self.running:
+            try:
+                # 'q' asks ffmpeg to finish the file cleanly
+                self.process.stdin.write(b"q")
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait(timeout=timeout)
+        errors = self.process.stderr.read().decode(errors="replace").strip()
+        if self.process.returncode not in (0, 255) and errors:
+            logging.error(f"ffmpeg passthrough recording ended with errors: {errors}")
+        self.process = None
+
+
+class SegmentedWriter:
+    """
+    cv2.VideoWriter replacement that rolls over to a new file every `segment_frames`
+    frames and encodes the segments on a small pool of background threads.
+
+    Segment i goes to worker i % workers, so consecutive segments are encoded in
+    parallel while each file still receives its frames in order. Every finished
+    segment is a complete, playable file; a crash loses at most the segments that
+    were still being encoded. A JSON manifest next to the segments lists them in
+    order with their status and frame ranges.
+
+    Parameters:
+    - path: Base output path; segments are named <stem>_seg0000<ext>.
+    - fourcc, fps, frame_size: Passed to every cv2.VideoWriter.
+    - segment_frames: Frames per segment.
+    - workers: Number of encoder threads.
+    - queue_size: Frames buffered per worker before write() blocks.
+    """
+
+    def __init__(self, path, fourcc, fps, frame_size, segment_frames, workers=2, queue_size=64):
+        self.path = path
+        self.fourcc = fourcc
+        self.fps = fps
+        self.frame_size = frame_size
+        self.segment_frames = max(1, int(segment_frames))
+        stem, self.ext = os.path.splitext(path)
+        self.stem = stem
+        self.manifest_path = f"{stem}_manifest.json"
+        self.segments = []
+        self.manifest_lock = threading.Lock()
+        self.frame_count = 0
+        self.segment_index = -1
+        self.error = None
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self.threads = [
+            threading.Thread(target=self._encode, args=(q,), name=f"segment-encoder-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+        self._write_manifest()
+
+    def isOpened(self):
+        return True
+
+    def _segment_path(self, index):
+        return f"{self.stem}_seg{index:04d}{self.ext}"
+
+    def _write_manifest(self):
+        with self.manifest_lock:
+            manifest = {
+                "base_path": self.path,
+                "fps": self.fps,
+                "frame_size": list(self.frame_size),
+                "segment_frames": self.segment_frames,
+                "segments": sorted(self.segments, key=lambda s: s["index"]),
+            }
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+    def _set_status(self, segment, status, **fields):
+        with self.manifest_lock:
+            segment["status"] = status
+            segment.update(fields)
+        self._write_manifest()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise RuntimeError(f"Segment encoder failed: {self.error}")
+        # The frame is queued by reference: do not overwrite it after writing
+        if self.frame_count % self.segment_frames == 0:
+            if self.segment_index >= 0:
+                self.queues[self.segment_index % len(self.queues)].put(_SEGMENT_END)
+            self.segment_index += 1
+            segment = {
+                "index": self.segment_index,
+                "path": self._segment_path(self.segment_index),
+                "start_frame": self.frame_count,
+                "frames": 0,
+                "status": "queued",
+            }
+            with self.manifest_lock:
+                self.segments.append(segment)
+            self._write_manifest()
+            self.queues[self.segment_index % len(self.queues)].put(segment)
+        self.queues[self.segment_index % len(self.queues)].put(frame)
+        self.frame_count += 1
+
+    def _encode(self, frames):
+        writer, segment, written = None, None, 0
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            try:
+                if isinstance(item, dict):
+                    segment, written = item, 0
+                    if self.error is not None:
+                        # Another segment failed: drain without encoding, write() raises anyway
+                        self._set_status(segment, "failed")
+                        continue
+                    writer = open_writer(segment["path"], self.fourcc, self.fps, self.frame_size)
+                    self._set_status(segment, "recording")
+                elif item is _SEGMENT_END:
+                    if writer is not None:
+                        writer.release()
+                        self._set_status(segment, "complete", frames=written)
+                    writer, segment = None, None
+                elif writer is not None:
+                    writer.write(item)
+                    written += 1
+            except Exception as e:
+                # Keep draining so the caller is not left blocked on a full queue
+                self.error = self.error or e
+                logging.error(f"Segment encoder failed on {segment['path']}: {e}")
+                self._set_status(segment, "failed", frames=written)
+                writer = None
+        if writer is not None:
+            try:
+                writer.release()
+                self._set_status(segment, "complete", frames=written)
+            except Exception as e:
+                self.error = self.error or e
+                logging.error(f"Segment encoder failed on {segment['path']}: {e}")
+                self._set_status(segment, "failed", frames=written)
+
+    def release(self):
+        if self.segment_index >= 0:
+            self.queues[self.segment_index % len(self.queues)].put(_SEGMENT_END)
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"{self.segment_index + 1} segments written, manifest: {self.manifest_path}")
+        if self.error is not None:
+            raise RuntimeError(f"Segment encoder failed: {self.error}")
+
+
+class AsyncWriter:
+    """
+    Wraps a writer so frames are encoded and written in a background thread.
+
+    write() only queues the frame. It blocks when the queue is full, so a slow codec
+    or disk slows the caller down instead of growing memory. depth() shows how
+    many frames are waiting. Same interface as cv2.VideoWriter.
+
+    Parameters:
+    - writer: Any object with write() and release(), e.g. from writer_from_env().
+    - queue_size: Frames that may wait for the encoder.
+    """
+
+    def __init__(self, writer, queue_size=16):
+        self.writer = writer
+        self.frames = queue.Queue(maxsize=max(1, queue_size))
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="async-writer", daemon=True)
+        self.thread.start()
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        if self.error is not None:
+            raise RuntimeError(f"Background writer failed: {self.error}")
+        self.frames.put(frame)
+
+    def _run(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            if self.error is None:
+                try:
+                    self.writer.write(frame)
+                except Exception as e:
+                    # Keep draining so the caller is not left blocked on a full queue
+                    self.error = e
+                    logging.error(f"Background writer failed: {e}")
+
+    def depth(self):
+        return self.frames.qsize()
+
+    def release(self):
+        self.frames.put(None)
+        self.thread.join()
+        self.writer.release()
+
+
+def async_writer_from_env(writer):
+    """`writer` behind an AsyncWriter of WRITER_QUEUE_SIZE frames (default 16) when ASYNC_IO=1."""
+    if os.getenv("ASYNC_IO", "0") != "1":
+        return writer
+    return AsyncWriter(writer, int(os.getenv("WRITER_QUEUE_SIZE", "16")))
+
+
+def writer_from_env(path, fourcc, fps, frame_size):
+    """
+    Single-file writer from open_writer(), or a SegmentedWriter when SEGMENT_MINUTES
+    or SEGMENT_FRAMES is set. ENCODER_WORKERS sets the size of the segment encoder pool.
+    """
+    segment_frames = int(os.getenv("SEGMENT_FRAMES", "0"))
+    segment_minutes = float(os.getenv("SEGMENT_MINUTES", "0"))
+    if not segment_frames and segment_minutes:
+        segment_frames = int(segment_minutes * 60 * fps)
+    if segment_frames:
+        return SegmentedWriter(
+            path, fourcc, fps, frame_size, segment_frames, workers=int(os.getenv("ENCODER_WORKERS", "2"))
+        )
+    return open_writer(path, fourcc, fps, frame_size)